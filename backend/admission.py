@@ -0,0 +1,198 @@
+import heapq
+import itertools
+import math
+import os
+import re
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Any, Dict
+
+# Admission control for /analyze. At most ADMISSION_MAX_CONCURRENT analyses run at once;
+# the rest wait in a bounded priority queue where reports that look critical go first.
+# When the queue is full, the lowest-priority waiter is shed with 429 + Retry-After.
+#
+#   ADMISSION_MAX_CONCURRENT=0        analyses allowed to run at once (0 = no admission control)
+#   ADMISSION_QUEUE_SIZE=32           waiters allowed in the queue
+#   ADMISSION_MAX_WAIT_SECONDS=60     a waiter that has not started by then gets a 429
+MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "0"))
+QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "32"))
+MAX_WAIT_SECONDS = float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "60"))
+WINDOW = 200
+
+# Lower value = served first.
+PRIORITIES = {"critical": 0, "normal": 1}
+
+CRITICAL_MARKERS = re.compile(
+    r"\[\s*critical|\bcritical\s+(?:value|result|high|low)s?\b|\bpanic\s+value|\bstat\s+call",
+    re.IGNORECASE,
+)
+
+# "No critical values identified.", "negative for panic values": the marker is negated
+# when one of these words comes earlier in the same line and sentence.
+NEGATION = re.compile(r"\b(?:no|none|not|without|negative\s+for)\b[^.;\n]*$", re.IGNORECASE)
+
+def _has_critical_marker(text: str) -> bool:
+    for match in CRITICAL_MARKERS.finditer(text):
+        # A bracketed [CRITICAL] flag is never prose, so it is never negated.
+        if match.group().startswith("["):
+            return True
+        if not NEGATION.search(text, max(0, match.start() - 60), match.start()):
+            return True
+    return False
+
+def classify(text: str) -> str:
+    """
+    Cheap local pre-scan, run before any LLM call: explicit critical markers in the
+    report, or an analyte value beyond the critical-value table (see red_flags.py).
+    """
+    if _has_critical_marker(text):
+        return "critical"
+    from .red_flags import evaluate_findings
+    if evaluate_findings(text.splitlines()):
+        return "critical"
+    return "normal"
+
+class Overloaded(Exception):
+    """Raised when a request is shed; retry_after is a hint in whole seconds."""
+
+    def __init__(self, priority: str, retry_after: int):
+        super().__init__(f"Server busy, {priority} request rejected")
+        self.priority = priority
+        self.retry_after = retry_after
+
+class _Waiter:
+    __slots__ = ("priority", "admitted", "shed")
+
+    def __init__(self, priority: str):
+        self.priority = priority
+        self.admitted = False
+        self.shed = False
+
+class AdmissionController:
+    def __init__(self, max_concurrent: int, queue_size: int, max_wait: float):
+        self.max_concurrent = max_concurrent
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+        self._cond = threading.Condition()
+        self._running = 0
+        self._queue = []  # heap of (priority rank, arrival order, waiter)
+        self._order = itertools.count()
+        self._waits: Dict[str, deque] = defaultdict(lambda: deque(maxlen=WINDOW))
+        self._service = deque(maxlen=WINDOW)
+        self._counts = defaultdict(int)
+        self._limiter = None
+
+    def _retry_after(self) -> int:
+        """Roughly how long until the current backlog drains. Caller holds the lock."""
+        service = sum(self._service) / len(self._service) if self._service else 1.0
+        return max(1, math.ceil(service * (len(self._queue) + 1) / max(self.max_concurrent, 1)))
+
+    def _shed(self, priority: str) -> Overloaded:
+        self._counts[f"shed:{priority}"] += 1
+        return Overloaded(priority, self._retry_after())
+
+    def _admit_next(self):
+        """Hands free slots to the best waiters. Caller holds the lock."""
+        while self._queue and self._running < self.max_concurrent:
+            _, _, waiter = heapq.heappop(self._queue)
+            waiter.admitted = True
+            self._running += 1
+        self._cond.notify_all()
+
+    def _remove(self, waiter: _Waiter):
+        self._queue = [item for item in self._queue if item[2] is not waiter]
+        heapq.heapify(self._queue)
+
+    @contextmanager
+    def admit(self, priority: str):
+        """Blocks until the request may run; raises Overloaded if it is shed instead."""
+        rank = PRIORITIES[priority]
+        start = time.monotonic()
+        with self._cond:
+            if self._running < self.max_concurrent and not self._queue:
+                self._running += 1
+            else:
+                if len(self._queue) >= self.queue_size:
+                    worst = max(self._queue, key=lambda item: (item[0], item[1])) if self._queue else None
+                    if worst is None or worst[0] <= rank:
+                        raise self._shed(priority)
+                    # A more urgent request displaces the newest of the least urgent waiters.
+                    self._remove(worst[2])
+                    worst[2].shed = True
+                    self._cond.notify_all()
+                waiter = _Waiter(priority)
+                heapq.heappush(self._queue, (rank, next(self._order), waiter))
+                deadline = start + self.max_wait
+                while not waiter.admitted and not waiter.shed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._remove(waiter)
+                        raise self._shed(priority)
+                    self._cond.wait(remaining)
+                if waiter.shed:
+                    raise self._shed(priority)
+            self._counts[f"admitted:{priority}"] += 1
+            self._waits[priority].append(time.monotonic() - start)
+
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._service.append(time.monotonic() - started)
+                self._running -= 1
+                self._admit_next()
+
+    def thread_limiter(self):
+        """
+        anyio limiter for the threads that run admitted work: one per running request
+        and per waiter, plus one for an arrival about to displace a waiter or be shed.
+        Later arrivals wait on the event loop without holding a thread.
+        """
+        if self._limiter is None:
+            import anyio
+            self._limiter = anyio.CapacityLimiter(self.max_concurrent + self.queue_size + 1)
+        return self._limiter
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._cond:
+            classes = {}
+            for priority in PRIORITIES:
+                waits = sorted(self._waits[priority])
+                classes[priority] = {
+                    "admitted": self._counts[f"admitted:{priority}"],
+                    "shed": self._counts[f"shed:{priority}"],
+                    "queued": sum(1 for item in self._queue if item[2].priority == priority),
+                    "wait_p50_seconds": waits[len(waits) // 2] if waits else 0.0,
+                    "wait_p95_seconds": waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0,
+                    "wait_max_seconds": waits[-1] if waits else 0.0,
+                }
+            return {
+                "enabled": True,
+                "max_concurrent": self.max_concurrent,
+                "queue_size": self.queue_size,
+                "running": self._running,
+                "classes": classes,
+            }
+
+_controller = AdmissionController(MAX_CONCURRENT, QUEUE_SIZE, MAX_WAIT_SECONDS) if MAX_CONCURRENT > 0 else None
+
+@contextmanager
+def admit(priority: str):
+    """Runs the block under admission control, or immediately if it is disabled."""
+    if _controller is None:
+        yield
+        return
+    with _controller.admit(priority):
+        yield
+
+def thread_limiter():
+    """Limiter for threads running admitted work; None (the default threadpool) when disabled."""
+    return None if _controller is None else _controller.thread_limiter()
+
+def get_stats() -> Dict[str, Any]:
+    if _controller is None:
+        return {"enabled": False}
+    return _controller.get_stats()
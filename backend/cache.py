@@ -0,0 +1,109 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Optional
+
+# Shared result cache for multi-worker deployments. Every uvicorn worker process opens
+# the same backend, so an analysis computed by one worker can be served by any other.
+#
+#   CACHE_BACKEND=none     (default) caching disabled
+#   CACHE_BACKEND=sqlite   local file, shared by all workers on one machine (CACHE_PATH)
+#   CACHE_BACKEND=redis    any Redis-protocol server (CACHE_URL), needs the `redis` package
+CACHE_TTL_SECONDS = int(os.getenv("CACHE_TTL_SECONDS", "86400"))
+
+class ResultCache(ABC):
+    """Interface for cache backends. Values are strings (JSON)."""
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[str]: ...
+
+    @abstractmethod
+    def set(self, key: str, value: str, ttl: int = CACHE_TTL_SECONDS): ...
+
+    @abstractmethod
+    def delete(self, key: str): ...
+
+class SQLiteCache(ResultCache):
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM cache WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, value: str, ttl: int = CACHE_TTL_SECONDS):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, now + ttl),
+            )
+            # Opportunistic cleanup keeps the file from growing with dead entries.
+            self._conn.execute("DELETE FROM cache WHERE expires_at <= ?", (now,))
+            self._conn.commit()
+
+    def delete(self, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+            self._conn.commit()
+
+class RedisCache(ResultCache):
+    def __init__(self, url: str, prefix: str = "dualmode:"):
+        try:
+            import redis
+        except ImportError:
+            raise ValueError("CACHE_BACKEND=redis requires the 'redis' package (pip install redis)")
+        self._client = redis.Redis.from_url(url, decode_responses=True)
+        self._prefix = prefix
+
+    def get(self, key: str) -> Optional[str]:
+        return self._client.get(self._prefix + key)
+
+    def set(self, key: str, value: str, ttl: int = CACHE_TTL_SECONDS):
+        self._client.set(self._prefix + key, value, ex=ttl)
+
+    def delete(self, key: str):
+        self._client.delete(self._prefix + key)
+
+_cache: Optional[ResultCache] = None
+_cache_loaded = False
+_cache_lock = threading.Lock()
+
+def get_result_cache() -> Optional[ResultCache]:
+    """Returns the configured cache backend (created on first use), or None if disabled."""
+    global _cache, _cache_loaded
+    if _cache_loaded:
+        return _cache
+    with _cache_lock:
+        if not _cache_loaded:
+            backend = os.getenv("CACHE_BACKEND", "none").lower()
+            if backend == "sqlite":
+                from .storage import HISTORY_FILE
+                default_path = os.path.join(os.path.dirname(HISTORY_FILE), "cache.db")
+                _cache = SQLiteCache(os.getenv("CACHE_PATH", default_path))
+            elif backend == "redis":
+                _cache = RedisCache(os.getenv("CACHE_URL", "redis://localhost:6379/0"))
+            elif backend != "none":
+                raise ValueError(f"Unknown CACHE_BACKEND: {backend}")
+            _cache_loaded = True
+    return _cache
+
+def cache_key(namespace: str, *parts) -> str:
+    """Hashes the inputs of a computation into a fixed-size cache key."""
+    digest = hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    return f"{namespace}:{digest}"
@@ -0,0 +1,130 @@
+import re
+from typing import List
+
+from .models import ReportExtraction, LabResult
+
+# Lines that start a new logical block in typical lab / radiology / discharge reports,
+# e.g. "FINDINGS:", "IMPRESSION", "CHEMISTRY:", "Page 2 of 7".
+SECTION_HEADER = re.compile(
+    r"^\s*(?:"
+    r"[A-Z][A-Z0-9 /&\-]{2,40}:?"                 # ALL-CAPS heading, optional colon
+    r"|(?i:findings|impression|history|technique|comparison|chemistry|hematology"
+    r"|urinalysis|medications|assessment|plan|diagnos[ie]s|notes)\s*:"
+    r"|(?i:page)\s+\d+(?:\s+of\s+\d+)?"
+    r")\s*$"
+)
+PAGE_BREAK = "\f"
+
+def split_sections(text: str) -> List[str]:
+    """Splits a report into sections at page breaks and section headings."""
+    sections = []
+    current: List[str] = []
+    for page in text.split(PAGE_BREAK):
+        for line in page.splitlines():
+            if SECTION_HEADER.match(line) and any(l.strip() for l in current):
+                sections.append("\n".join(current).strip())
+                current = []
+            current.append(line)
+        if any(l.strip() for l in current):
+            sections.append("\n".join(current).strip())
+        current = []
+    return [s for s in sections if s]
+
+def _split_oversized(section: str, max_chars: int) -> List[str]:
+    """Breaks a single section that is too large on line boundaries."""
+    parts = []
+    current = ""
+    for line in section.splitlines(keepends=True):
+        if current and len(current) + len(line) > max_chars:
+            parts.append(current.strip())
+            current = ""
+        # A single line longer than the limit is hard-wrapped.
+        while len(line) > max_chars:
+            parts.append(line[:max_chars])
+            line = line[max_chars:]
+        current += line
+    if current.strip():
+        parts.append(current.strip())
+    return parts
+
+class ReportChunker:
+    """
+    Packs consecutive sections into chunks of at most `max_chars`, never splitting a
+    section unless it alone exceeds the limit. Chunks after the first are prefixed with
+    the report's first line so the model still knows what kind of document it is reading.
+
+    Pages are fed one at a time and every chunk is returned as soon as it is complete,
+    so work on the start of a document can begin while later pages are still being read.
+    """
+
+    def __init__(self, max_chars: int):
+        self.max_chars = max_chars
+        self.title = None
+        self._current = ""
+        self._emitted = 0
+
+    def _emit(self) -> str:
+        chunk = self._current
+        if self._emitted:
+            chunk = f"[Continued excerpt of report: {self.title}]\n\n{chunk}"
+        self._emitted += 1
+        self._current = ""
+        return chunk
+
+    def add_page(self, page: str) -> List[str]:
+        """Adds one page of text and returns the chunks it completed."""
+        if self.title is None:
+            self.title = next((l.strip() for l in page.splitlines() if l.strip()), None)
+        done = []
+        for section in split_sections(page):
+            pieces = _split_oversized(section, self.max_chars) if len(section) > self.max_chars else [section]
+            for piece in pieces:
+                if self._current and len(self._current) + len(piece) + 2 > self.max_chars:
+                    done.append(self._emit())
+                self._current = f"{self._current}\n\n{piece}" if self._current else piece
+        return done
+
+    def finish(self) -> List[str]:
+        """Returns the last, partially filled chunk (if any)."""
+        return [self._emit()] if self._current else []
+
+def chunk_report(text: str, max_chars: int) -> List[str]:
+    """Splits a whole report into chunks (see ReportChunker)."""
+    chunker = ReportChunker(max_chars)
+    chunks = []
+    for page in text.split(PAGE_BREAK):
+        chunks += chunker.add_page(page)
+    return chunks + chunker.finish()
+
+def _lab_key(lab: LabResult):
+    return (" ".join(lab.name.lower().split()), (lab.unit or "").strip().lower(), lab.value)
+
+def merge_extractions(parts: List[ReportExtraction]) -> ReportExtraction:
+    """
+    Combines per-chunk extractions in chunk order. Lists are concatenated with
+    duplicates removed (labs by name, unit and value); scalar fields take the first
+    informative value.
+    """
+    report_type = next(
+        (p.report_type for p in parts if p.report_type and p.report_type.lower() != "unknown"),
+        parts[0].report_type if parts else "Unknown",
+    )
+    exam = next((p.exam for p in parts if p.exam), None)
+
+    labs = {}
+    for part in parts:
+        for lab in part.labs:
+            key = _lab_key(lab)
+            if key not in labs:
+                labs[key] = lab
+            elif lab.flag and not labs[key].flag:
+                labs[key] = lab  # keep the copy that carries the report's flag
+
+    return ReportExtraction(
+        report_type=report_type,
+        exam=exam,
+        findings=list(dict.fromkeys(f for p in parts for f in p.findings)),
+        impression=list(dict.fromkeys(i for p in parts for i in p.impression)),
+        labs=list(labs.values()),
+        critical_values=list(dict.fromkeys(c for p in parts for c in p.critical_values)),
+    )
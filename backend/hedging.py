@@ -0,0 +1,210 @@
+import contextvars
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+# Request hedging for LLM calls. If a call has not returned after the configured
+# percentile of recently observed latencies for its stage, an identical request is
+# fired and whichever valid response arrives first is used; the other is aborted.
+#
+#   LLM_HEDGING=1                 enable (default off)
+#   LLM_HEDGE_PERCENTILE=95       hedge delay, as a percentile of recent latency
+#   LLM_HEDGE_MAX_EXTRA=0.1       at most this fraction of recent calls may be hedged
+#   LLM_HEDGE_MIN_SAMPLES=20      no hedging until a stage has this many observations
+HEDGING_ENABLED = os.getenv("LLM_HEDGING", "0") == "1"
+HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+HEDGE_MAX_EXTRA = float(os.getenv("LLM_HEDGE_MAX_EXTRA", "0.1"))
+HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+WINDOW = 200
+
+_lock = threading.Lock()
+_latencies: Dict[str, deque] = defaultdict(lambda: deque(maxlen=WINDOW))
+_recent_hedged: deque = deque(maxlen=WINDOW)  # one bool per call, for the spend cap
+_stats = defaultdict(int)
+_executor: Optional[ThreadPoolExecutor] = None
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=int(os.getenv("LLM_HEDGE_THREADS", "32")),
+                                           thread_name_prefix="llm-hedge")
+        return _executor
+
+def record_latency(stage: str, seconds: float):
+    with _lock:
+        _latencies[stage].append(seconds)
+
+def hedge_delay(stage: str) -> Optional[float]:
+    """Seconds to wait before hedging this stage, or None if there is not enough history."""
+    with _lock:
+        samples = sorted(_latencies[stage])
+    if len(samples) < HEDGE_MIN_SAMPLES:
+        return None
+    return samples[min(len(samples) - 1, int(len(samples) * HEDGE_PERCENTILE / 100))]
+
+def _within_budget() -> bool:
+    with _lock:
+        if not _recent_hedged:
+            return True
+        return (sum(_recent_hedged) + 1) / len(_recent_hedged) <= HEDGE_MAX_EXTRA
+
+def _timed(fn: Callable[[], Any]):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+class _Attempt:
+    """One call of fn inside hedged_call, with the callbacks that abort it early."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self.cancelled = False
+
+    def add(self, callback: Callable[[], Any]):
+        with self._lock:
+            if not self.cancelled:
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass
+
+_current_attempt: contextvars.ContextVar[Optional[_Attempt]] = contextvars.ContextVar("hedge_attempt", default=None)
+
+def on_cancel(callback: Callable[[], Any]):
+    """
+    Registers how to abort the current call early (e.g. closing its response stream)
+    if a duplicate of it wins the hedge race. Does nothing outside hedged_call.
+    """
+    attempt = _current_attempt.get()
+    if attempt is not None:
+        attempt.add(callback)
+
+def hedged_call(
+    fn: Callable[[], Any],
+    stage: str,
+    validate: Callable[[Any], bool] = lambda result: True,
+    enabled: Optional[bool] = None,
+) -> Any:
+    """
+    Calls fn(), hedging with a second identical call if the first is slower than usual.
+    A result is accepted only if validate(result) is true, on both paths; if no attempt
+    succeeds, the primary's error is raised. The primary runs on the caller's thread, so
+    the hedge delay counts from when it really started; only hedges use the pool. The
+    losing attempt is aborted through the callbacks it registered with on_cancel().
+    """
+    enabled = HEDGING_ENABLED if enabled is None else enabled
+    delay = hedge_delay(stage) if enabled else None
+    with _lock:
+        _stats["calls"] += 1
+
+    if delay is None:
+        result, elapsed = _timed(fn)
+        record_latency(stage, elapsed)
+        with _lock:
+            _recent_hedged.append(False)
+        if not validate(result):
+            raise ValueError(f"No valid LLM response for stage '{stage}'")
+        return result
+
+    race = threading.Condition()
+    state: Dict[str, Any] = {"winner": None, "primary_done": False, "hedge": None}
+    primary_attempt, hedge_attempt = _Attempt(), _Attempt()
+    context = contextvars.copy_context()
+
+    def run_hedge():
+        result, elapsed, valid = None, 0.0, False
+        if not hedge_attempt.cancelled:  # the primary may have won while this was queued
+            _current_attempt.set(hedge_attempt)
+            try:
+                result, elapsed = _timed(fn)
+                valid = validate(result)
+            except Exception:
+                pass
+        with race:
+            state["hedge"] = "done"
+            won = valid and state["winner"] is None
+            if won:
+                state["winner"] = ("hedge", result, elapsed)
+            race.notify_all()
+        if won:
+            primary_attempt.cancel()
+
+    def fire_hedge():
+        with race:
+            if state["primary_done"]:
+                return
+            if not _within_budget():
+                with _lock:
+                    _stats["budget_skipped"] += 1
+                return
+            with _lock:
+                _stats["hedges_fired"] += 1
+            state["hedge"] = "running"
+        _get_executor().submit(context.copy().run, run_hedge)
+
+    timer = threading.Timer(delay, fire_hedge)
+    timer.daemon = True
+    token = _current_attempt.set(primary_attempt)
+    timer.start()
+    primary_error = None
+    try:
+        result, elapsed = _timed(fn)
+        valid = validate(result)
+    except Exception as e:
+        primary_error, valid = e, False
+    finally:
+        _current_attempt.reset(token)
+        timer.cancel()
+
+    with race:
+        state["primary_done"] = True
+        if valid and state["winner"] is None:
+            state["winner"] = ("primary", result, elapsed)
+        # A failed or invalid primary waits for a hedge that is still running.
+        while state["winner"] is None and state["hedge"] == "running":
+            race.wait()
+        winner, hedged = state["winner"], state["hedge"] is not None
+    with _lock:
+        _recent_hedged.append(hedged)
+
+    if winner is None:
+        if primary_error is not None:
+            raise primary_error
+        raise ValueError(f"No valid LLM response for stage '{stage}'")
+    role, result, elapsed = winner
+    if role == "primary":
+        hedge_attempt.cancel()
+    if hedged:
+        with _lock:
+            _stats["hedge_wins" if role == "hedge" else "primary_wins"] += 1
+    # The winner's own duration is the latency this stage would have seen.
+    record_latency(stage, elapsed if role == "primary" else delay + elapsed)
+    return result
+
+def get_stats() -> Dict[str, Any]:
+    """Counters plus the current hedge delay per stage, for the metrics endpoint."""
+    with _lock:
+        stats = dict(_stats)
+        stages = list(_latencies)
+    stats.setdefault("calls", 0)
+    for key in ("hedges_fired", "hedge_wins", "primary_wins", "budget_skipped"):
+        stats.setdefault(key, 0)
+    stats["hedge_rate"] = stats["hedges_fired"] / stats["calls"] if stats["calls"] else 0.0
+    stats["hedge_win_rate"] = stats["hedge_wins"] / stats["hedges_fired"] if stats["hedges_fired"] else 0.0
+    stats["enabled"] = HEDGING_ENABLED
+    stats["hedge_delay_seconds"] = {stage: hedge_delay(stage) for stage in stages}
+    return stats
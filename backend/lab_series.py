@@ -0,0 +1,181 @@
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+# Per-analyte lab time series, kept column-wise in typed arrays so range queries are a
+# pair of bisects and downsampling is a single pass over contiguous floats. Values are
+# stored in the analyte's canonical unit (see red_flags.py) so that reports using
+# different units still chart on one axis.
+
+class LabSeries:
+    def __init__(self, analyte: str, unit: Optional[str]):
+        self.analyte = analyte
+        self.unit = unit
+        self.times = array("d")   # POSIX seconds, ascending
+        self.values = array("d")
+        self.report_ids: List[str] = []
+
+    def append(self, t: float, value: float, report_id: str):
+        if not self.times or t >= self.times[-1]:
+            self.times.append(t)
+            self.values.append(value)
+            self.report_ids.append(report_id)
+            return
+        # Out-of-order write (e.g. backfill); keep the columns sorted by time.
+        i = bisect_right(self.times, t)
+        self.times.insert(i, t)
+        self.values.insert(i, value)
+        self.report_ids.insert(i, report_id)
+
+    def window(self, since: Optional[float], until: Optional[float]):
+        lo = bisect_left(self.times, since) if since is not None else 0
+        hi = bisect_right(self.times, until) if until is not None else len(self.times)
+        return lo, hi
+
+_lock = threading.Lock()
+_series: Dict[str, LabSeries] = {}
+# (history file path, history version) the in-memory series currently reflect. Other
+# worker processes may append to the same file, so a version we did not produce means
+# the series are stale and get rebuilt on the next read.
+_loaded_from: Optional[tuple] = None
+
+def _to_epoch(timestamp: str) -> float:
+    return datetime.fromisoformat(timestamp).timestamp()
+
+def _resolve(name: str, unit: Optional[str], value: float):
+    """Returns (series key, display name, unit, value in that unit) or None if not convertible."""
+    from .red_flags import get_rule_index, normalize_name
+    analyte = get_rule_index().resolve(name)
+    if analyte is None:
+        return normalize_name(name), name, unit, value
+    canonical = analyte.to_canonical(value, unit)
+    if canonical is None:
+        return None
+    return analyte.name.lower(), analyte.name, analyte.unit, canonical
+
+def _add_entry(entry: Dict[str, Any]):
+    """Appends every lab row of a history entry. Caller must hold _lock."""
+    labs = ((entry.get("full_data") or {}).get("extraction") or {}).get("labs") or []
+    if not labs:
+        return
+    t = _to_epoch(entry["timestamp"])
+    for lab in labs:
+        name, value = lab.get("name"), lab.get("value")
+        if not name or value is None:
+            continue
+        resolved = _resolve(name, lab.get("unit"), value)
+        if resolved is None:
+            continue
+        key, display, unit, value = resolved
+        series = _series.get(key)
+        if series is None:
+            series = _series[key] = LabSeries(display, unit)
+        elif series.unit != unit:
+            continue  # unknown analyte reported in a different unit; not comparable
+        series.append(t, value, entry["id"])
+
+def _ensure_loaded():
+    """
+    (Re)builds the store from the history file if it changed since we last saw it.
+    Reports moved to the archive by retention compaction keep their points.
+    """
+    global _loaded_from
+    from . import storage
+    from .retention import archived_lab_entries
+    current = (storage.HISTORY_FILE, storage.get_history_version())
+    if _loaded_from == current:
+        return
+    _series.clear()
+    history = storage._load_history()
+    hot_ids = {entry["id"] for entry in history}
+    for entry in archived_lab_entries():
+        # A crash mid-compaction can leave a report in both places.
+        if entry["id"] not in hot_ids:
+            _add_entry(entry)
+    for entry in history:
+        _add_entry(entry)
+    _loaded_from = current
+
+def add_report(entry: Dict[str, Any], version_before: str, version_after: str):
+    """
+    Adds a newly saved history entry to the time-series store. If the store was not in
+    sync with the file right before this write, it is left stale and rebuilt on next read.
+    """
+    global _loaded_from
+    from . import storage
+    with _lock:
+        if _loaded_from == (storage.HISTORY_FILE, version_before):
+            _add_entry(entry)
+            _loaded_from = (storage.HISTORY_FILE, version_after)
+
+def _downsample(series: LabSeries, lo: int, hi: int, max_points: int) -> List[Dict[str, Any]]:
+    n = hi - lo
+    times, values, ids = series.times, series.values, series.report_ids
+    if n <= max_points:
+        return [
+            {
+                "timestamp": datetime.fromtimestamp(times[i]).isoformat(),
+                "value": values[i], "min": values[i], "max": values[i],
+                "count": 1, "report_id": ids[i],
+            }
+            for i in range(lo, hi)
+        ]
+
+    # Equal-count buckets; min/max are kept so critical excursions survive downsampling.
+    points = []
+    for b in range(max_points):
+        start = lo + b * n // max_points
+        end = lo + (b + 1) * n // max_points
+        chunk = values[start:end]
+        points.append({
+            "timestamp": datetime.fromtimestamp(times[(start + end - 1) // 2]).isoformat(),
+            "value": sum(chunk) / len(chunk),
+            "min": min(chunk),
+            "max": max(chunk),
+            "count": len(chunk),
+            "report_id": None,
+        })
+    return points
+
+def get_trend(
+    analyte: str,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    max_points: int = 200,
+) -> Optional[Dict[str, Any]]:
+    """
+    Returns the time series for an analyte between `since` and `until` (ISO timestamps),
+    reduced to at most `max_points` points. None if the analyte has never been recorded.
+    """
+    from .red_flags import analyte_key
+    key = analyte_key(analyte)
+
+    with _lock:
+        _ensure_loaded()
+        series = _series.get(key)
+        if series is None:
+            return None
+        lo, hi = series.window(
+            _to_epoch(since) if since else None,
+            _to_epoch(until) if until else None,
+        )
+        points = _downsample(series, lo, hi, max_points)
+
+    return {
+        "analyte": series.analyte,
+        "unit": series.unit,
+        "total_points": hi - lo,
+        "downsampled": hi - lo > max_points,
+        "points": points,
+    }
+
+def list_analytes() -> List[Dict[str, Any]]:
+    """Returns every recorded analyte with its unit and number of data points."""
+    with _lock:
+        _ensure_loaded()
+        return [
+            {"analyte": s.analyte, "unit": s.unit, "count": len(s.times)}
+            for s in sorted(_series.values(), key=lambda s: s.analyte.lower())
+        ]
@@ -1,27 +1,101 @@
 import os
 import json
 import base64
-from dotenv import load_dotenv
-from openai import OpenAI
+import contextvars
+import threading
 from .models import ReportExtraction, PatientExplanation, ClinicianSummary
-from .prompts import SAFETY_EDITOR_PROMPT, EXTRACTION_PROMPT, PATIENT_PROMPT, CLINICIAN_PROMPT, NO_TEXT_PATIENT_PROMPT
+from .prompts import SAFETY_EDITOR_PROMPT, EXTRACTION_PROMPT, PATIENT_PROMPT, CLINICIAN_PROMPT, NO_TEXT_PATIENT_PROMPT, TRUNCATED_DRAFT_PROMPT
+from .profiling import tracked
 
-load_dotenv(override=True)
+# The OpenAI SDK and .env loading are deferred to the first LLM call so that
+# serverless cold starts serving /history or the health check never pay for them.
+MODEL = "gpt-4o"
 
-API_KEY = os.getenv("OPENAI_API_KEY")
-MODEL = os.getenv("OPENAI_MODEL", "gpt-4o") # Default to vision-capable model
-BASE_URL = os.getenv("OPENAI_BASE_URL")
+_client = None
+_client_loaded = False
+_client_lock = threading.Lock()
 
+def get_client():
+    """Returns the shared OpenAI client, creating it on first use (None if no API key)."""
+    global _client, _client_loaded, MODEL
+    if _client_loaded:
+        return _client
+    with _client_lock:
+        if not _client_loaded:
+            from dotenv import load_dotenv
+            load_dotenv(override=True)
 
-client = None
-if API_KEY:
-    client = OpenAI(api_key=API_KEY, base_url=BASE_URL)
+            api_key = os.getenv("OPENAI_API_KEY")
+            MODEL = os.getenv("OPENAI_MODEL", "gpt-4o") # Default to vision-capable model
+            if api_key:
+                from openai import OpenAI
+                _client = OpenAI(api_key=api_key, base_url=os.getenv("OPENAI_BASE_URL"))
+            _client_loaded = True
+    return _client
 
 def is_real_mode():
-    return client is not None
+    return get_client() is not None
+
+# Generators stream their output so the safety blocklists can run while it arrives.
+STREAMING_ENABLED = os.getenv("LLM_STREAMING", "1") == "1"
+
+def _complete(stage: str, safety_check: bool = False, language: str = "English", **kwargs) -> str:
+    """
+    Sends one chat completion for a pipeline stage and returns the message content.
+    The model is chosen per stage by routing.py (possibly downgraded under load), and
+    the call is hedged if enabled. With safety_check, the completion is streamed and
+    aborted with SafetyViolation as soon as the partial output trips a blocklist
+    (one the local rewriter cannot fix, when the output language is English).
+    """
+    from .hedging import HEDGING_ENABLED, hedged_call
+    from .routing import select_model, record_decision, track_call
+    client = get_client()
+    model, reason = select_model(stage, MODEL)
+    record_decision(stage, model, reason)
+
+    def call() -> str:
+        # Streams can be closed by hedged_call when a duplicate request wins, so with
+        # hedging on every stage streams.
+        if STREAMING_ENABLED and (safety_check or HEDGING_ENABLED):
+            return _stream_with_safety_check(client, model, kwargs, language, safety_check)
+        response = client.chat.completions.create(model=model, **kwargs)
+        return response.choices[0].message.content
+
+    with track_call(stage, model, MODEL):
+        return hedged_call(call, f"{stage}/{model}", validate=bool)
+
+def _stream_with_safety_check(client, model: str, kwargs: dict, language: str = "English",
+                              safety_check: bool = True) -> str:
+    from .hedging import on_cancel
+    from .safety_validator import StreamingSafetyChecker, SafetyViolation, LOCALLY_REWRITABLE
+    checker = StreamingSafetyChecker()
+    stream = client.chat.completions.create(model=model, stream=True, **kwargs)
+    # If a hedged duplicate of this call wins, stop generating this one.
+    on_cancel(stream.close)
+    try:
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+            if not safety_check:
+                checker.buffer += delta
+                continue
+            violations = checker.feed(delta)
+            # Phrasing the local rewriter can fix is cheaper to let through than to
+            # abort on and regenerate. Its replacements are English only.
+            if violations and (language != "English"
+                               or any(v["match"] not in LOCALLY_REWRITABLE for v in violations)):
+                # Closing the stream stops generation; no more tokens are produced.
+                raise SafetyViolation(violations, checker.buffer)
+    finally:
+        stream.close()
+    return checker.buffer
 
 def extract_text_from_image(image_bytes: bytes) -> str:
     """Uses LLM Vision to read text from an image. Strictly OCR only."""
+    client = get_client()
     if not client:
         raise ValueError("LLM client not initialized")
 
@@ -41,8 +115,7 @@ def extract_text_from_image(image_bytes: bytes) -> str:
     """
 
     try:
-        response = client.chat.completions.create(
-            model=MODEL,
+        content = _complete("ocr",
             messages=[
                 {"role": "system", "content": system_prompt},
                 {
@@ -55,25 +128,102 @@ def extract_text_from_image(image_bytes: bytes) -> str:
             ],
             max_tokens=1000
         )
-        return response.choices[0].message.content
+        return content
     except Exception as e:
         print(f"Vision Extraction Error: {e}")
         raise e
 
+# Reports longer than this are split into sections and extracted concurrently.
+EXTRACTION_CHUNK_CHARS = int(os.getenv("EXTRACTION_CHUNK_CHARS", "6000"))
+EXTRACTION_MAX_WORKERS = int(os.getenv("EXTRACTION_MAX_WORKERS", "4"))
+
+# Returned by extract_text_from_image for scans without written reporting text.
+NO_TEXT_MARKER = "[[NO_REPORT_TEXT_FOUND]]"
+
+def _no_text_extraction() -> ReportExtraction:
+    # Return a dummy extraction that signals the generator to use the fallback prompt
+    return ReportExtraction(
+        report_type="Imaging Scan (No Text)",
+        findings=[], 
+        impression=[], 
+        labs=[], 
+        critical_values=[]
+    )
+
 def extract_facts(text: str) -> ReportExtraction:
+    client = get_client()
     if not client:
         raise ValueError("LLM client not initialized")
         
-    if "[[NO_REPORT_TEXT_FOUND]]" in text:
-        # Return a dummy extraction that signals the generator to use the fallback prompt
-        return ReportExtraction(
-            report_type="Imaging Scan (No Text)",
-            findings=[], 
-            impression=[], 
-            labs=[], 
-            critical_values=[]
-        )
+    if NO_TEXT_MARKER in text:
+        return _no_text_extraction()
+
+    if len(text) <= EXTRACTION_CHUNK_CHARS:
+        return _extract_chunk(text)
+
+    # Long documents: one completion per chunk, run concurrently, so latency tracks the
+    # longest chunk rather than the whole document. Results are merged in chunk order.
+    from concurrent.futures import ThreadPoolExecutor
+    from .chunking import chunk_report, merge_extractions
+
+    chunks = chunk_report(text, EXTRACTION_CHUNK_CHARS)
+    if len(chunks) == 1:
+        return _extract_chunk(chunks[0])
+    with ThreadPoolExecutor(max_workers=min(EXTRACTION_MAX_WORKERS, len(chunks))) as pool:
+        # copy_context keeps the caller's routing log visible inside the worker threads.
+        futures = [pool.submit(contextvars.copy_context().run, _extract_chunk, chunk) for chunk in chunks]
+        parts = [future.result() for future in futures]
+    return merge_extractions(parts)
+
+class IncrementalExtraction:
+    """
+    Extraction for documents that arrive page by page (e.g. while a PDF is parsed).
+    Each chunk is sent to the model as soon as enough pages have been read to fill it,
+    so the completions overlap with parsing the rest of the file.
+    """
 
+    def __init__(self):
+        from concurrent.futures import ThreadPoolExecutor
+        from .chunking import ReportChunker
+        if not get_client():
+            raise ValueError("LLM client not initialized")
+        self._chunker = ReportChunker(EXTRACTION_CHUNK_CHARS)
+        self._pool = ThreadPoolExecutor(max_workers=EXTRACTION_MAX_WORKERS)
+        self._futures = []
+        self._no_text = False
+
+    def _submit(self, chunks):
+        for chunk in chunks:
+            # copy_context keeps the caller's routing log visible inside the worker threads.
+            self._futures.append(self._pool.submit(contextvars.copy_context().run, _extract_chunk, chunk))
+
+    def add_page(self, text: str) -> int:
+        """Feeds one page; returns how many chunks have been sent for extraction so far."""
+        if NO_TEXT_MARKER in text:
+            # Same short-circuit as extract_facts: a scan with no report text is not extracted.
+            self._no_text = True
+            return len(self._futures)
+        self._submit(self._chunker.add_page(text))
+        return len(self._futures)
+
+    def result(self) -> ReportExtraction:
+        """Waits for every chunk and merges them in document order."""
+        from .chunking import merge_extractions
+        if self._no_text:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            return _no_text_extraction()
+        try:
+            self._submit(self._chunker.finish())
+            parts = [future.result() for future in self._futures]
+        finally:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+        if not parts:
+            raise ValueError("No text to extract")
+        return parts[0] if len(parts) == 1 else merge_extractions(parts)
+
+@tracked
+def _extract_chunk(text: str) -> ReportExtraction:
+    client = get_client()
     system_prompt = f"""
     {EXTRACTION_PROMPT}
     """
@@ -81,15 +231,14 @@ def extract_facts(text: str) -> ReportExtraction:
     schema = json.dumps(ReportExtraction.model_json_schema())
 
     try:
-        response = client.chat.completions.create(
-            model=MODEL,
+        content = _complete("extraction",
             messages=[
                 {"role": "system", "content": f"{system_prompt}\nSchema: {schema}"},
                 {"role": "user", "content": text}
             ],
             response_format={"type": "json_object"}
         )
-        data = json.loads(response.choices[0].message.content)
+        data = json.loads(content)
         # Ensure regex checks or post-processing if needed, for now trust LLM + Schema
         return ReportExtraction(**data)
     except Exception as e:
@@ -100,6 +249,7 @@ def extract_facts(text: str) -> ReportExtraction:
         raise e
 
 def generate_patient_explanation(extraction: ReportExtraction, language: str = "English") -> PatientExplanation:
+    client = get_client()
     if not client:
         raise ValueError("LLM client not initialized")
         
@@ -125,18 +275,18 @@ def generate_patient_explanation(extraction: ReportExtraction, language: str = "
     schema = json.dumps(PatientExplanation.model_json_schema())
     facts_json = extraction.model_dump_json()
 
-    response = client.chat.completions.create(
-        model=MODEL,
+    content = _complete("patient", safety_check=True, language=language,
         messages=[
             {"role": "system", "content": f"{system_prompt}\nSchema: {schema}"},
             {"role": "user", "content": f"Findings: {facts_json}"}
         ],
         response_format={"type": "json_object"}
     )
-    data = json.loads(response.choices[0].message.content)
+    data = json.loads(content)
     return PatientExplanation(**data)
 
 def generate_clinician_summary(extraction: ReportExtraction, language: str = "English") -> ClinicianSummary:
+    client = get_client()
     if not client:
         raise ValueError("LLM client not initialized")
 
@@ -149,36 +299,42 @@ def generate_clinician_summary(extraction: ReportExtraction, language: str = "En
     schema = json.dumps(ClinicianSummary.model_json_schema())
     facts_json = extraction.model_dump_json()
 
-    response = client.chat.completions.create(
-        model=MODEL,
+    content = _complete("clinician", safety_check=True, language=language,
         messages=[
             {"role": "system", "content": f"{system_prompt}\nSchema: {schema}"},
             {"role": "user", "content": f"Findings: {facts_json}"}
         ],
         response_format={"type": "json_object"}
     )
-    data = json.loads(response.choices[0].message.content)
+    data = json.loads(content)
     return ClinicianSummary(**data)
 
-def rewrite_safely(unsafe_text: str, violations: list, schema_model, language: str = "English") -> dict:
+def rewrite_safely(unsafe_text: str, violations: list, schema_model, language: str = "English", facts_json: str = None) -> dict:
+    """
+    Asks the safety editor to rewrite a draft. `facts_json` is given when the draft was
+    cut short mid-stream, so missing fields can be completed from the findings alone.
+    """
+    client = get_client()
     if not client:
         raise ValueError("LLM client not initialized")
         
     system_prompt = f"""
     {SAFETY_EDITOR_PROMPT}
-
+    {TRUNCATED_DRAFT_PROMPT if facts_json else ""}
     VIOLATIONS FOUND: {json.dumps(violations)}
     OUTPUT IN LANGUAGE: {language}
     """
     
     schema = json.dumps(schema_model.model_json_schema())
+    user_content = f"Unsafe Draft: {unsafe_text}"
+    if facts_json:
+        user_content += f"\n\nFindings: {facts_json}"
 
-    response = client.chat.completions.create(
-        model=MODEL,
+    content = _complete("rewrite",
         messages=[
             {"role": "system", "content": f"{system_prompt}\nSchema: {schema}"},
-            {"role": "user", "content": f"Unsafe Draft: {unsafe_text}"}
+            {"role": "user", "content": user_content}
         ],
         response_format={"type": "json_object"}
     )
-    return json.loads(response.choices[0].message.content)
+    return json.loads(content)
@@ -1,5 +1,7 @@
+import contextvars
 import json
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from .models import (
     AnalysisRequest, ReportExtraction, PatientExplanation, 
     ClinicianSummary, ApiResponse
@@ -10,18 +12,36 @@ from .llm_client import (
     generate_clinician_summary,
     rewrite_safely
 )
-from .safety_validator import validate_output
+from .safety_validator import validate_output, rewrite_locally, SafetyViolation
+from .profiling import tracked
 from .safe_fallbacks import get_safe_fallback_patient, get_safe_fallback_clinician
+from .red_flags import evaluate_extraction
+from .routing import start_routing_log
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def analyze_report(text: str, mode: str, language: str = "English") -> ApiResponse:
-    logger.info(f"Analyzing report in mode: {mode}, language: {language}")
+def analyze_report(
+    text: str,
+    mode: str,
+    language: str = "English",
+    languages: list[str] = None,
+    extraction: ReportExtraction = None,
+) -> ApiResponse:
+    """
+    Runs the full pipeline. When `languages` is given, the report is extracted and
+    summarised for clinicians once (in the first language) and a patient explanation is
+    generated for every language concurrently, each through its own safety loop.
+    Pass `extraction` if the facts were already extracted (e.g. while a file was read).
+    """
+    languages = list(dict.fromkeys(languages)) if languages else [language]
+    language = languages[0]
+    logger.info(f"Analyzing report in mode: {mode}, languages: {languages}")
+    routing_log = start_routing_log()
     
     # 1. Extraction
     try:
-        extraction = extract_facts(text)
+        if extraction is None:
+            extraction = extract_facts(text)
     except Exception as e:
         logger.error(f"Extraction failed: {e}")
         raise e 
@@ -29,20 +49,36 @@ def analyze_report(text: str, mode: str, language: str = "English") -> ApiRespon
     # 2. Red Flags Check
     red_flags = check_red_flags(extraction)
     
-    # 3. Generate Analysis with Safety Loop
-    patient_expl, p_status, p_violations = generate_safe_content(
-        extraction, PatientExplanation, generate_patient_explanation, get_safe_fallback_patient, language
-    )
-    
-    clinician_sum, c_status, c_violations = generate_safe_content(
-        extraction, ClinicianSummary, generate_clinician_summary, get_safe_fallback_clinician, language
-    )
+    # 3. Generate Analysis with Safety Loop (one task per patient language + clinician)
+    with ThreadPoolExecutor(max_workers=len(languages) + 1) as pool:
+        patient_futures = {
+            lang: pool.submit(
+                contextvars.copy_context().run, generate_safe_content,
+                extraction, PatientExplanation, generate_patient_explanation, get_safe_fallback_patient, lang
+            )
+            for lang in languages
+        }
+        clinician_future = pool.submit(
+            contextvars.copy_context().run, generate_safe_content,
+            extraction, ClinicianSummary, generate_clinician_summary, get_safe_fallback_clinician, language
+        )
+        patient_results = {lang: future.result() for lang, future in patient_futures.items()}
+        clinician_sum, c_status, c_violations = clinician_future.result()
+
+    statuses = [c_status]
+    violations = []
+    for lang, (_, p_status, p_violations) in patient_results.items():
+        statuses.append(p_status)
+        if len(languages) > 1:
+            p_violations = [{**v, "language": lang} for v in p_violations]
+        violations += p_violations
+    violations += c_violations
 
     # Combine statuses (worst case wins)
     final_status = "passed"
-    if p_status == "fallback" or c_status == "fallback":
+    if "fallback" in statuses:
         final_status = "fallback"
-    elif p_status == "rewritten" or c_status == "rewritten":
+    elif "rewritten" in statuses:
         final_status = "rewritten"
 
     return ApiResponse(
@@ -51,12 +87,16 @@ def analyze_report(text: str, mode: str, language: str = "English") -> ApiRespon
         engine_mode="real",
         red_flags=red_flags,
         extraction=extraction,
-        patient_analysis=patient_expl,
+        patient_analysis=patient_results[language][0],
         clinician_analysis=clinician_sum,
         safety_status=final_status,
-        violations=p_violations + c_violations
+        violations=violations,
+        language=language,
+        patient_variants={lang: result[0] for lang, result in patient_results.items()} if len(languages) > 1 else {},
+        routing=routing_log,
     )
 
+@tracked
 def generate_safe_content(
     extraction: ReportExtraction, 
     model_class, 
@@ -73,18 +113,39 @@ def generate_safe_content(
         logging.info(f"Generating content in {language}")
 
     try:
-        content = generator_func(extraction, language=language)
-        content_json = content.model_dump_json() # Use JSON for validation string check
-        validation = validate_output(content_json)
+        facts_json = None
+        try:
+            content = generator_func(extraction, language=language)
+            content_json = content.model_dump_json() # Use JSON for validation string check
+            validation = validate_output(content_json)
+        except SafetyViolation as e:
+            # The stream was aborted at the first violation; rewrite from the partial draft
+            # plus the findings rather than paying for the rest of the completion.
+            logger.warning(f"Safety violation mid-stream; generation aborted early. Violations: {e.violations}")
+            content_json = e.partial_text
+            validation = {"is_safe": False, "violations": e.violations}
+            facts_json = extraction.model_dump_json()
         
         if validation["is_safe"]:
             return content, "passed", []
         
-        # Step 2: Retry (Rewrite)
-        logger.warning(f"Safety violation detected. Retrying... Violations: {validation['violations']}")
         violations = validation["violations"]
+
+        # Step 2a: Local rewrite of mechanical phrase matches; no LLM round trip needed.
+        if facts_json is None and language == "English":
+            local_dict, replaced = rewrite_locally(content.model_dump())
+            if replaced:
+                content = model_class(**local_dict)
+                content_json = content.model_dump_json()
+                validation = validate_output(content_json)
+                if validation["is_safe"]:
+                    logger.info(f"Safety violations fixed locally ({replaced} replacements): {violations}")
+                    return content, "rewritten", violations
+
+        # Step 2b: Retry (LLM rewrite) for whatever is left
+        logger.warning(f"Safety violation detected. Retrying... Violations: {validation['violations']}")
         
-        rewritten_dict = rewrite_safely(content_json, violations, model_class, language=language)
+        rewritten_dict = rewrite_safely(content_json, validation["violations"], model_class, language=language, facts_json=facts_json)
         content = model_class(**rewritten_dict)
         content_json = content.model_dump_json()
         
@@ -100,26 +161,6 @@ def generate_safe_content(
         logger.error(f"Generation error: {e}")
         return fallback_func(extraction), "fallback", [{"rule": "System Error", "match": str(e)}]
 
-def check_red_flags(extraction: ReportExtraction) -> list[str]:
-    flags = []
-    # Check text findings
-    for finding in extraction.findings:
-        desc = finding.lower()
-        if "potassium" in desc and "6." in desc: 
-             flags.append("CRITICAL: Potassium level is dangerously high.")
-    
-    # Check structured labs
-    for lab in extraction.labs:
-        if lab.name and "potassium" in lab.name.lower() and lab.value is not None:
-             if lab.value > 6.0:
-                 flags.append(f"CRITICAL: {lab.name} {lab.value} (High)")
-        
-        if lab.flag == "CRITICAL":
-            flags.append(f"REPORTED CRITICAL: {lab.name} {lab.value}")
-    
-    # Check explicit critical values
-    if extraction.critical_values:
-        for val in extraction.critical_values:
-            flags.append(f"REPORTED CRITICAL: {val}")
-            
-    return list(set(flags))
+def check_red_flags(extraction: ReportExtraction, age: float = None, sex: str = None) -> list[str]:
+    """Evaluates the extraction against the critical-value table (see red_flags.py)."""
+    return evaluate_extraction(extraction, age=age, sex=sex)
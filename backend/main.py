@@ -1,16 +1,32 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Query
 from fastapi.middleware.cors import CORSMiddleware
-import uvicorn
+from fastapi.middleware.gzip import GZipMiddleware
+from contextlib import asynccontextmanager
+from typing import List, Optional, Literal
 from .models import AnalysisRequest, ApiResponse
 from .logic import analyze_report
+from .admission import Overloaded, admit, classify, thread_limiter
+from .profiling import ProfilingMiddleware, profiled
+import hmac
 import logging
 
 logger = logging.getLogger(__name__)
 
 import os # Added import
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    logging.basicConfig(level=logging.INFO)
+    from .retention import start_scheduler
+    import threading
+    stop = threading.Event()
+    start_scheduler(stop)
+    yield
+    stop.set()
+
 app = FastAPI(
     title="Dual-Mode AI Healthcare Backend",
+    lifespan=lifespan,
     root_path="/api" if os.environ.get("VERCEL") else ""
 )
 
@@ -27,12 +43,38 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
+# Compress larger JSON/PDF bodies; tiny responses are not worth the CPU.
+GZIP_MIN_SIZE = int(os.environ.get("GZIP_MIN_SIZE", "1024"))
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MIN_SIZE)
+# Marks requests for the on-demand profiler (X-Profile header or PROFILE_SAMPLE_RATE).
+app.add_middleware(ProfilingMiddleware)
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    """Checks If-None-Match against an ETag (weak comparison, as per RFC 9110)."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    candidates = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return etag.removeprefix("W/") in candidates
+
+# analyze_report makes blocking LLM calls, so it runs on a worker thread rather than on
+# the event loop. Requests waiting for admission block their thread too, so with admission
+# control on they draw threads from its own limiter instead of the default threadpool
+# that every other sync endpoint shares.
 @app.post("/analyze", response_model=ApiResponse)
 async def analyze_endpoint(request: AnalysisRequest):
+    import anyio
+    return await anyio.to_thread.run_sync(_run_analysis, request, limiter=thread_limiter())
+
+@profiled
+def _run_analysis(request: AnalysisRequest) -> ApiResponse:
     try:
-        response = analyze_report(request.text, request.mode, request.language)
+        response = _cached_analysis(request)
         # Save to history - async/background task would be better but simple sync call is fine for prototype
         try:
              report_id = save_report(response.model_dump())
@@ -41,6 +83,12 @@ async def analyze_endpoint(request: AnalysisRequest):
              logger.error(f"Failed to save history: {e}")
              
         return response
+    except Overloaded as e:
+        raise HTTPException(
+            status_code=429,
+            detail="Server is busy, please retry shortly.",
+            headers={"Retry-After": str(e.retry_after)},
+        )
     except ValueError as e:
         # Catch explicit "LLM client not initialized" from logic/client
         if "LLM client" in str(e):
@@ -53,9 +101,38 @@ async def analyze_endpoint(request: AnalysisRequest):
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
-from fastapi import UploadFile, File
+def _cached_analysis(request: AnalysisRequest) -> ApiResponse:
+    """Runs analyze_report, sharing results across workers when CACHE_BACKEND is set."""
+    from .cache import get_result_cache, cache_key
+    cache = get_result_cache()
+    if cache is None:
+        return _admitted_analysis(request)
+
+    key = cache_key("analysis:v1", request.text, request.mode, request.language, request.languages)
+    try:
+        cached = cache.get(key)
+    except Exception as e:
+        logger.error(f"Result cache read failed: {e}")
+        cached = None
+    if cached:
+        return ApiResponse.model_validate_json(cached)
+
+    response = _admitted_analysis(request)
+    # Fallbacks may stem from transient provider errors; don't pin them in the cache.
+    if response.safety_status != "fallback":
+        try:
+            cache.set(key, response.model_dump_json())
+        except Exception as e:
+            logger.error(f"Result cache write failed: {e}")
+    return response
+
+def _admitted_analysis(request: AnalysisRequest) -> ApiResponse:
+    """Runs analyze_report once admission control lets it; critical-looking reports go first."""
+    with admit(classify(request.text)):
+        return analyze_report(request.text, request.mode, request.language, request.languages)
+
+from fastapi import UploadFile, File, Form
 import io
-from pypdf import PdfReader
 
 @app.post("/extract_text")
 async def extract_text_endpoint(file: UploadFile = File(...)):
@@ -65,11 +142,13 @@ async def extract_text_endpoint(file: UploadFile = File(...)):
         
         # 1. Handle PDF
         if content_type == "application/pdf":
+            from pypdf import PdfReader
+            from .chunking import PAGE_BREAK
             pdf_file = io.BytesIO(contents)
             reader = PdfReader(pdf_file)
-            text = ""
-            for page in reader.pages:
-                text += page.extract_text() + "\n"
+            # Keep page boundaries for the chunker when the text comes back to /analyze;
+            # the newline before the form feed keeps the text readable in the browser.
+            text = ("\n" + PAGE_BREAK).join(page.extract_text() or "" for page in reader.pages)
             return {"text": text.strip()}
             
         # 2. Handle Images (Vision)
@@ -87,25 +166,126 @@ async def extract_text_endpoint(file: UploadFile = File(...)):
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Failed to process file: {str(e)}")
 
-from .storage import save_report, get_history_list, get_report_detail
+@app.post("/analyze_file")
+async def analyze_file_endpoint(
+    file: UploadFile = File(...),
+    mode: Literal["patient", "clinician"] = Form("patient"),
+    language: str = Form("English"),
+    languages: List[str] = Form([]),
+):
+    """
+    Upload a PDF or image and get the analysis in one call. The response is a stream of
+    JSON lines: progress events while the file is read and extracted, then the result.
+    """
+    content_type = file.content_type or ""
+    if content_type != "application/pdf" and not content_type.startswith("image/"):
+        raise HTTPException(status_code=400, detail="Only PDF and Image files are supported.")
+    if len(languages) > 5:
+        raise HTTPException(status_code=422, detail="At most 5 languages")
+    contents = await file.read()
+
+    # An async generator: a sync one would be iterated on the threadpool and hold a
+    # thread for the whole analysis, including the wait for admission.
+    async def stream():
+        from .pipeline import analyze_upload
+        import anyio
+        import json
+        async for event in analyze_upload(contents, content_type, mode, language, languages):
+            if event["event"] == "result":
+                response = event["data"]
+                try:
+                    response.id = await anyio.to_thread.run_sync(save_report, response.model_dump())
+                except Exception as e:
+                    logger.error(f"Failed to save history: {e}")
+                event = {"event": "result", "data": response.model_dump(mode="json")}
+            yield json.dumps(event) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+from .storage import save_report, get_history_list, get_report_detail, get_history_version, get_history_changes
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 
 @app.get("/history")
-def get_history():
+def get_history(request: Request):
     """Get list of past analyses."""
-    return get_history_list()
+    # Weak ETag: the list changes whenever a report is written.
+    etag = f'W/"{get_history_version()}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(content=get_history_list(), headers=headers)
+
+@app.get("/history/changes")
+def get_history_changes_endpoint(
+    since: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+):
+    """Metadata of reports saved after the `since` cursor, for incremental client sync."""
+    if since is not None and not since.isdigit():
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return get_history_changes(int(since) if since is not None else None, limit=limit)
+
+@app.get("/search")
+def search_history(
+    q: Optional[str] = None,
+    analyte: Optional[str] = None,
+    flag: Optional[Literal["HIGH", "LOW", "NORMAL", "CRITICAL"]] = None,
+    red_flagged: Optional[bool] = None,
+    limit: int = Query(50, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+):
+    """Search past analyses by free text, analyte, lab flag and red flags."""
+    from .search_index import search_reports
+    return search_reports(q=q, analyte=analyte, flag=flag, red_flagged=red_flagged, limit=limit, offset=offset)
+
+@app.get("/trends")
+def list_trend_analytes():
+    """List analytes that have recorded lab values."""
+    from .lab_series import list_analytes
+    return list_analytes()
+
+@app.get("/trends/{analyte}")
+def get_lab_trend(
+    analyte: str,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    max_points: int = Query(200, ge=2, le=5000),
+):
+    """Time series of one analyte across stored reports, downsampled to max_points."""
+    from .lab_series import get_trend
+    try:
+        trend = get_trend(analyte, since=since, until=until, max_points=max_points)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="since/until must be ISO 8601 timestamps")
+    if trend is None:
+        raise HTTPException(status_code=404, detail="No values recorded for this analyte")
+    return trend
 
 @app.get("/history/{report_id}")
-def get_history_item(report_id: str):
+def get_history_item(report_id: str, request: Request):
     """Get full details of a specific analysis."""
     data = get_report_detail(report_id)
     if not data:
         raise HTTPException(status_code=404, detail="Report not found")
-    return data
+    # Stored reports are never modified, so the id is a strong validator of the JSON.
+    # GZipMiddleware may compress the body without touching validators, and a strong
+    # ETag must differ between content codings, so it is weak when gzip is on offer.
+    etag = f'"{report_id}"'
+    if "gzip" in request.headers.get("accept-encoding", ""):  # GZipMiddleware's own test
+        etag = f"W/{etag}"
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=86400, immutable", "Vary": "Accept-Encoding"}
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(content=data, headers=headers)
+
 
-from fastapi.responses import Response
-from .pdf_generator import generate_report_pdf
+def generate_report_pdf(report_data: dict) -> bytes:
+    # reportlab is only imported when a PDF is actually requested.
+    from .pdf_generator import generate_report_pdf as _generate
+    return _generate(report_data)
 
 @app.get("/history/{report_id}/pdf")
+@profiled
 def get_report_pdf(report_id: str):
     """Download analysis as PDF."""
     data = get_report_detail(report_id)
@@ -121,6 +301,7 @@ def get_report_pdf(report_id: str):
     )
 
 @app.post("/generate_pdf")
+@profiled
 def generate_pdf_endpoint(report_data: ApiResponse):
     """Generate PDF from provided report data (stateless)."""
     pdf_bytes = generate_report_pdf(report_data.model_dump())
@@ -134,9 +315,67 @@ def generate_pdf_endpoint(report_data: ApiResponse):
         headers={"Content-Disposition": f"attachment; filename={report_id}.pdf"}
     )
 
+@app.get("/metrics/llm")
+def llm_metrics():
+    """Hedging counters, per-stage hedge delays and model routing state for LLM calls."""
+    from .hedging import get_stats
+    from .routing import get_stats as get_routing_stats
+    return {**get_stats(), "routing": get_routing_stats()}
+
+def _require_admin(request: Request):
+    """Admin endpoints are off unless ADMIN_TOKEN is configured, and then need it in X-Admin-Token."""
+    token = os.environ.get("ADMIN_TOKEN")
+    if not token:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled; set ADMIN_TOKEN to enable them")
+    if not hmac.compare_digest(request.headers.get("x-admin-token", ""), token):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+@app.post("/admin/compact", status_code=202)
+def trigger_compaction(
+    request: Request,
+    max_entries: Optional[int] = Query(None, ge=0),
+    max_age_days: Optional[float] = Query(None, ge=0),
+):
+    """Starts a history compaction run (overriding the configured policy if given)."""
+    _require_admin(request)
+    from .retention import start_compaction_in_background, get_status
+    started = start_compaction_in_background(max_entries=max_entries, max_age_days=max_age_days)
+    return {"started": started, **get_status()}
+
+@app.get("/admin/compact")
+def compaction_status(request: Request):
+    """Progress of the current or last history compaction run."""
+    _require_admin(request)
+    from .retention import get_status
+    return get_status()
+
+@app.get("/admin/profiles")
+def list_request_profiles(request: Request):
+    """Most recent request profiles, newest first."""
+    _require_admin(request)
+    from .profiling import list_profiles
+    return list_profiles()
+
+@app.get("/admin/profiles/{profile_id}")
+def get_request_profile(profile_id: str, request: Request):
+    """One profile as folded stacks (flamegraph.pl / speedscope input)."""
+    _require_admin(request)
+    from .profiling import get_profile
+    profile = get_profile(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return Response(content=profile.folded(), media_type="text/plain")
+
+@app.get("/metrics/admission")
+def admission_metrics():
+    """Queue depth, shed counts and queue wait times per priority class for /analyze."""
+    from .admission import get_stats
+    return get_stats()
+
 @app.get("/")
 def health_check():
     return {"status": "ok", "message": "Backend is running"}
 
 if __name__ == "__main__":
+    import uvicorn
     uvicorn.run("backend.main:app", host="0.0.0.0", port=8000, reload=True)
@@ -1,10 +1,13 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Literal
 
 class AnalysisRequest(BaseModel):
     text: str
     mode: Literal["patient", "clinician"] = "patient"
     language: str = "English"
+    # Optional fan-out: patient explanations in each of these languages from one
+    # extraction. The first entry is the primary language and overrides `language`.
+    languages: List[str] = Field(default_factory=list, max_length=5)
 
 class LabResult(BaseModel):
     name: str
@@ -50,4 +53,9 @@ class ApiResponse(BaseModel):
     safety_status: Literal["passed", "rewritten", "fallback"] = "passed"
     violations: List[Dict[str, str]] = []
     id: Optional[str] = None
+    language: Optional[str] = None
+    # Patient explanation per language when several were requested (includes the primary).
+    patient_variants: Dict[str, PatientExplanation] = {}
+    # Model used for each LLM stage of this analysis, and why (see routing.py).
+    routing: List[Dict[str, str]] = []
 
@@ -70,6 +70,17 @@ def generate_report_pdf(report_data: dict) -> bytes:
         story.append(ListFlowable(qs_items, bulletType='bullet', start='•'))
         story.append(Spacer(1, 0.2 * inch))
 
+    # Additional languages requested alongside the primary one
+    primary_language = report_data.get('language')
+    for lang, variant in (report_data.get('patient_variants') or {}).items():
+        if lang == primary_language:
+            continue
+        story.append(Paragraph(f"Patient Explanation ({lang})", styles['Heading2']))
+        story.append(Paragraph(variant.get('summary', ''), normal_style))
+        v_items = [ListItem(Paragraph(kp, normal_style)) for kp in variant.get('key_points', [])]
+        story.append(ListFlowable(v_items, bulletType='bullet', start='•'))
+        story.append(Spacer(1, 0.2 * inch))
+
     if clinician_analysis:
         story.append(Paragraph("Clinician Summary", styles['Heading2']))
         
@@ -0,0 +1,137 @@
+import asyncio
+import contextvars
+import io
+import logging
+import threading
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from .admission import Overloaded, admit, classify
+from .chunking import PAGE_BREAK
+from .logic import analyze_report, check_red_flags
+from .routing import start_routing_log
+
+# Single-call upload-and-analyze. The file is read, extracted and analysed on a worker
+# thread while the client receives progress events, so a PDF's first pages are already
+# with the model while later pages are still being parsed, and the report text never
+# makes a round trip through the browser.
+#
+# Events (one JSON object per line):
+#   {"event": "page", "page": 3, "pages": 10, "chunks_started": 1}
+#   {"event": "text", "chars": 18234}
+#   {"event": "extraction", "extraction": {...}, "red_flags": [...]}
+#   {"event": "result", "data": <ApiResponse>}
+#   {"event": "error", "status": 429, "detail": "...", "retry_after": 5}
+
+logger = logging.getLogger(__name__)
+_DONE = object()
+
+def _pdf_pages(contents: bytes):
+    # pypdf parses each page's content stream lazily, on extract_text().
+    from pypdf import PdfReader
+    reader = PdfReader(io.BytesIO(contents))
+    total = len(reader.pages)
+    for number, page in enumerate(reader.pages, start=1):
+        yield number, total, page.extract_text() or ""
+
+def _image_pages(contents: bytes):
+    # A generator, so the OCR call happens on first next() inside the admitted block.
+    from .llm_client import extract_text_from_image
+    yield 1, 1, extract_text_from_image(contents)
+
+def _run(contents: bytes, content_type: str, mode: str, language: str, languages: List[str], emit):
+    from .llm_client import IncrementalExtraction
+
+    routing_log = start_routing_log()
+    if content_type == "application/pdf":
+        pages = _pdf_pages(contents)
+        # Priority is decided on the first page; critical markers are nearly always there.
+        first = next(pages, None)
+        if first is None:
+            emit({"event": "error", "status": 422, "detail": "The file has no pages."})
+            return
+        priority = classify(first[2])
+        pages = _chain(first, pages)
+    elif content_type.startswith("image/"):
+        # OCR is itself a model call, so it has to wait for admission; with no text yet
+        # to classify, images queue at normal priority.
+        pages = _image_pages(contents)
+        priority = "normal"
+    else:
+        emit({"event": "error", "status": 400, "detail": "Only PDF and Image files are supported."})
+        return
+
+    with admit(priority):
+        extraction = IncrementalExtraction()
+        texts = []
+        for number, total, text in pages:
+            texts.append(text)
+            started = extraction.add_page(text)
+            emit({"event": "page", "page": number, "pages": total, "chunks_started": started})
+        # Same text /extract_text would have returned.
+        full_text = ("\n" + PAGE_BREAK).join(texts).strip()
+        if not full_text:
+            emit({"event": "error", "status": 422, "detail": "No text could be read from the file."})
+            return
+        emit({"event": "text", "chars": len(full_text)})
+
+        facts = extraction.result()
+        emit({
+            "event": "extraction",
+            "extraction": facts.model_dump(),
+            "red_flags": check_red_flags(facts),
+        })
+        response = analyze_report(full_text, mode, language, languages, extraction=facts)
+
+    response.routing = routing_log + [d for d in response.routing if d not in routing_log]
+    emit({"event": "result", "data": response})
+
+def _chain(first, rest):
+    yield first
+    yield from rest
+
+async def analyze_upload(
+    contents: bytes,
+    content_type: str,
+    mode: str,
+    language: str = "English",
+    languages: Optional[List[str]] = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Runs the whole pipeline for an uploaded file on a worker thread and yields its
+    progress events as they happen (see the module comment for the event types).
+    Events are handed over through an asyncio queue, so the response waits on the
+    event loop and does not hold a threadpool thread for the length of the analysis.
+    """
+    loop = asyncio.get_running_loop()
+    events: asyncio.Queue = asyncio.Queue()
+
+    def put(event):
+        try:
+            loop.call_soon_threadsafe(events.put_nowait, event)
+        except RuntimeError:
+            pass  # the loop is gone (client disconnected and the server shut down)
+
+    def work():
+        try:
+            _run(contents, content_type, mode, language, languages or [], put)
+        except Overloaded as e:
+            put({"event": "error", "status": 429, "detail": "Server is busy, please retry shortly.",
+                 "retry_after": e.retry_after})
+        except ValueError as e:
+            if "LLM client" in str(e):
+                put({"event": "error", "status": 503, "detail": "OpenAI API Key is missing. Server is strictly in Real Mode. Please configure .env."})
+            else:
+                logger.error(f"Upload analysis failed: {e}")
+                put({"event": "error", "status": 500, "detail": str(e)})
+        except Exception as e:
+            logger.error(f"Upload analysis failed: {e}")
+            put({"event": "error", "status": 500, "detail": str(e)})
+        finally:
+            put(_DONE)
+
+    threading.Thread(target=contextvars.copy_context().run, args=(work,), name="upload-analysis", daemon=True).start()
+    while True:
+        event = await events.get()
+        if event is _DONE:
+            return
+        yield event
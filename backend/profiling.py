@@ -0,0 +1,183 @@
+import contextvars
+import hmac
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+from typing import Any, Dict, List, Optional
+
+# On-demand sampling profiler for individual requests. A profiled request has its
+# thread's stack sampled every PROFILE_INTERVAL_MS and the samples kept as folded
+# stacks ("frame;frame;frame count" per line), which flamegraph.pl, speedscope and
+# most flamegraph viewers read directly.
+#
+#   X-Profile: 1 request header    profile this request (needs ADMIN_TOKEN set and sent as X-Admin-Token)
+#   PROFILE_SAMPLE_RATE=0          fraction of requests to profile without the header
+#   PROFILE_INTERVAL_MS=5          sampling interval
+#   PROFILE_KEEP=20                how many recent profiles to keep
+#
+# When nothing is being profiled the cost is one context variable lookup per request
+# and per instrumented function; no sampler thread exists.
+SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+INTERVAL = float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000
+KEEP = int(os.getenv("PROFILE_KEEP", "20"))
+MAX_DEPTH = 128
+
+# Set by the middleware when this request should be profiled (value: why).
+_requested: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("profile_requested", default=None)
+_active: contextvars.ContextVar[Optional["Profile"]] = contextvars.ContextVar("active_profile", default=None)
+
+_lock = threading.Lock()
+_profiles: deque = deque(maxlen=KEEP)
+
+class Profile:
+    def __init__(self, name: str, trigger: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.trigger = trigger
+        self.started_at = datetime.now().isoformat()
+        self.duration = 0.0
+        self.samples: Counter = Counter()
+        self.threads: Dict[int, str] = {}
+        self._labels: Dict[Any, str] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _frame_label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            self._labels[code] = label
+        return label
+
+    def _sample(self):
+        frames = sys._current_frames()
+        me = threading.get_ident()
+        for ident, role in list(self.threads.items()):
+            frame = frames.get(ident)
+            if frame is None or ident == me:
+                continue
+            stack = []
+            while frame is not None and len(stack) < MAX_DEPTH:
+                stack.append(self._frame_label(frame.f_code))
+                frame = frame.f_back
+            stack.append(role)
+            self.samples[";".join(reversed(stack))] += 1
+
+    def _run(self):
+        while not self._stop.wait(INTERVAL):
+            self._sample()
+
+    def start(self):
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name=f"profiler-{self.id}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.perf_counter() - self._started
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "trigger": self.trigger,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration * 1000, 1),
+            "samples": sum(self.samples.values()),
+            "interval_ms": INTERVAL * 1000,
+        }
+
+class ProfilingMiddleware:
+    """Pure ASGI middleware that marks requests for profiling (see module comment)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        trigger = _trigger(scope) if scope["type"] == "http" else None
+        if trigger is None:
+            return await self.app(scope, receive, send)
+        token = _requested.set(trigger)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _requested.reset(token)
+
+def _trigger(scope) -> Optional[str]:
+    headers = dict(scope["headers"])
+    if headers.get(b"x-profile") == b"1":
+        # Like the admin endpoints: ignored unless ADMIN_TOKEN is configured and sent.
+        admin_token = os.environ.get("ADMIN_TOKEN")
+        if admin_token and hmac.compare_digest(headers.get(b"x-admin-token", b""), admin_token.encode()):
+            return "header"
+    if SAMPLE_RATE and random.random() < SAMPLE_RATE:
+        return "sampled"
+    return None
+
+def profiled(fn):
+    """
+    Profiles calls of a (sync) endpoint when the middleware marked the request. Runs on
+    the threadpool thread that executes the endpoint, so that is the thread sampled.
+    """
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        trigger = _requested.get()
+        if trigger is None:
+            return fn(*args, **kwargs)
+        profile = Profile(fn.__name__, trigger)
+        profile.threads[threading.get_ident()] = "request"
+        token = _active.set(profile)
+        profile.start()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profile.stop()
+            _active.reset(token)
+            with _lock:
+                _profiles.append(profile)
+    return wrapper
+
+@contextmanager
+def track_thread():
+    """
+    Includes the current worker thread in the active profile, if any. Used by code that
+    fans work out to thread pools (with copy_context) on behalf of a request.
+    """
+    profile = _active.get()
+    ident = threading.get_ident()
+    if profile is None or ident in profile.threads:
+        yield
+        return
+    profile.threads[ident] = "worker"
+    try:
+        yield
+    finally:
+        profile.threads.pop(ident, None)
+
+def tracked(fn):
+    """Decorator form of track_thread() for functions run on worker threads."""
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        with track_thread():
+            return fn(*args, **kwargs)
+    return wrapper
+
+def list_profiles() -> List[Dict[str, Any]]:
+    """Summaries of the stored profiles, newest first."""
+    with _lock:
+        return [p.summary() for p in reversed(_profiles)]
+
+def get_profile(profile_id: str) -> Optional[Profile]:
+    with _lock:
+        return next((p for p in _profiles if p.id == profile_id), None)
@@ -137,3 +137,10 @@ APPROVED SAFE REPLACEMENTS:
 FINAL OUTPUT FORMAT:
 You MUST return valid JSON matching the schema provided.
 """
+
+# Appended to SAFETY_EDITOR_PROMPT when generation was stopped early by the streaming
+# safety check and the draft is incomplete.
+TRUNCATED_DRAFT_PROMPT = """
+NOTE: The draft was cut off because it contained forbidden wording, so it may be incomplete or invalid JSON.
+Complete any missing fields using ONLY the structured findings provided. Do NOT add information that is not in the findings.
+"""
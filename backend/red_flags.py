@@ -0,0 +1,376 @@
+import json
+import os
+import re
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# CRITICAL VALUE TABLE
+# Each entry describes one analyte: the names it is reported under, its canonical unit,
+# conversion factors from other units into the canonical one, and one or more threshold
+# rules. A value strictly below `low` or strictly above `high` is critical.
+# Rules may be qualified by `sex` ("M"/"F") and/or an age range in years; the most
+# specific matching rule wins, unqualified rules are the default.
+#
+# Override the whole table with a JSON file of the same shape via CRITICAL_VALUES_FILE.
+CRITICAL_VALUES = [
+    {
+        "analyte": "Potassium",
+        "synonyms": ["potassium", "k", "k+", "serum potassium", "plasma potassium"],
+        "unit": "mmol/l",
+        "conversions": {"meq/l": 1.0},
+        "rules": [
+            {"low": 2.5, "high": 6.0},
+            {"max_age": 1, "low": 2.5, "high": 6.5},
+        ],
+    },
+    {
+        "analyte": "Sodium",
+        "synonyms": ["sodium", "na", "na+", "serum sodium"],
+        "unit": "mmol/l",
+        "conversions": {"meq/l": 1.0},
+        "rules": [{"low": 120, "high": 160}],
+    },
+    {
+        "analyte": "Glucose",
+        "synonyms": ["glucose", "blood glucose", "serum glucose", "fasting glucose", "glu"],
+        "unit": "mg/dl",
+        "conversions": {"mmol/l": 18.016},
+        "rules": [
+            {"low": 40, "high": 500},
+            {"max_age": 1, "low": 30, "high": 300},
+        ],
+    },
+    {
+        "analyte": "Calcium",
+        "synonyms": ["calcium", "ca", "total calcium", "serum calcium"],
+        "unit": "mg/dl",
+        "conversions": {"mmol/l": 4.008, "meq/l": 2.004},
+        "rules": [{"low": 6.0, "high": 13.0}],
+    },
+    {
+        "analyte": "Creatinine",
+        "synonyms": ["creatinine", "creat", "serum creatinine", "cr"],
+        "unit": "mg/dl",
+        "conversions": {"umol/l": 1 / 88.42},
+        "rules": [
+            {"high": 7.4},
+            {"max_age": 18, "high": 3.8},
+        ],
+    },
+    {
+        "analyte": "Hemoglobin",
+        "synonyms": ["hemoglobin", "haemoglobin", "hgb", "hb"],
+        "unit": "g/dl",
+        "conversions": {"g/l": 0.1, "mmol/l": 1.611},
+        "rules": [
+            {"low": 7.0, "high": 20.0},
+            {"sex": "F", "low": 7.0, "high": 19.0},
+            {"max_age": 0.1, "low": 9.5, "high": 22.0},
+        ],
+    },
+    {
+        "analyte": "Platelets",
+        "synonyms": ["platelets", "platelet count", "plt"],
+        "unit": "10^3/ul",
+        "conversions": {"10^9/l": 1.0, "k/ul": 1.0, "/ul": 0.001},
+        "rules": [{"low": 20, "high": 1000}],
+    },
+    {
+        "analyte": "WBC",
+        "synonyms": ["wbc", "white blood cells", "white blood cell count", "leukocytes"],
+        "unit": "10^3/ul",
+        "conversions": {"10^9/l": 1.0, "k/ul": 1.0, "/ul": 0.001},
+        "rules": [{"low": 2.0, "high": 30.0}],
+    },
+    {
+        "analyte": "Total Bilirubin",
+        "synonyms": ["bilirubin", "total bilirubin", "t. bili", "tbili"],
+        "unit": "mg/dl",
+        "conversions": {"umol/l": 1 / 17.1},
+        "rules": [{"max_age": 1, "high": 15.0}],
+    },
+]
+
+@dataclass(frozen=True)
+class CriticalRule:
+    low: Optional[float]
+    high: Optional[float]
+    sex: Optional[str]
+    min_age: Optional[float]
+    max_age: Optional[float]
+
+    @property
+    def specificity(self) -> int:
+        return sum(q is not None for q in (self.sex, self.min_age, self.max_age))
+
+    def applies_to(self, age: Optional[float], sex: Optional[str]) -> bool:
+        if self.sex is not None and self.sex != sex:
+            return False
+        if self.min_age is not None and (age is None or age < self.min_age):
+            return False
+        if self.max_age is not None and (age is None or age >= self.max_age):
+            return False
+        return True
+
+@dataclass(frozen=True, eq=False)
+class CompiledAnalyte:
+    name: str
+    unit: str
+    conversions: Dict[str, float]
+    rules: Tuple[CriticalRule, ...]  # most specific first
+
+    def to_canonical(self, value: float, unit: Optional[str]) -> Optional[float]:
+        """Converts value into the canonical unit. None if the unit is not recognised."""
+        if not unit:
+            return value
+        unit = normalize_unit(unit)
+        if unit == self.unit:
+            return value
+        factor = self.conversions.get(unit)
+        return value * factor if factor is not None else None
+
+    def rule_for(self, age: Optional[float], sex: Optional[str]) -> Optional[CriticalRule]:
+        for rule in self.rules:
+            if rule.applies_to(age, sex):
+                return rule
+        return None
+
+    def limits_for(self, unit: Optional[str], age: Optional[float], sex: Optional[str]) -> Tuple:
+        """
+        Returns the (low, high) thresholds expressed in `unit`, so raw values can be
+        compared without converting each one. Empty tuple if the unit is unknown or
+        no rule applies.
+        """
+        factor = self.to_canonical(1.0, unit)
+        rule = self.rule_for(age, sex)
+        if factor is None or rule is None:
+            return ()
+        return (
+            rule.low / factor if rule.low is not None else None,
+            rule.high / factor if rule.high is not None else None,
+        )
+
+# Words labs commonly add around an analyte name ("Potassium, Serum", "Glucose level").
+_NAME_QUALIFIERS = {"serum", "plasma", "blood", "whole", "level", "levels", "random", "venous", "arterial", "(serum)", "(plasma)"}
+
+@dataclass(frozen=True)
+class RuleIndex:
+    by_name: Dict[str, CompiledAnalyte]
+    # Matches "<analyte name> [separator] <number> [unit]" in free-text findings.
+    text_pattern: Optional[re.Pattern]
+    _resolved: Dict[str, Optional[CompiledAnalyte]] = field(default_factory=dict, compare=False, repr=False)
+    _limits: Dict[Tuple, Dict[Tuple, Tuple]] = field(default_factory=dict, compare=False, repr=False)
+
+    def resolve(self, name: str) -> Optional[CompiledAnalyte]:
+        """Maps a reported lab name to its analyte, memoising the result per raw name."""
+        try:
+            return self._resolved[name]
+        except KeyError:
+            pass
+        if len(self._resolved) > 10000:
+            self._resolved.clear()
+        key = normalize_name(name)
+        analyte = self.by_name.get(key)
+        if analyte is None:
+            stripped = " ".join(t for t in key.split() if t not in _NAME_QUALIFIERS)
+            analyte = self.by_name.get(stripped)
+        self._resolved[name] = analyte
+        return analyte
+
+    def lookup(self, name: str, unit: Optional[str], age: Optional[float], sex: Optional[str]) -> Tuple:
+        """Returns (analyte, low, high) with thresholds in the row's own unit, or () if not checkable."""
+        analyte = self.resolve(name)
+        if analyte is None:
+            return ()
+        limits = analyte.limits_for(unit, age, sex)
+        return (analyte.name, *limits) if limits else ()
+
+    def limits_table(self, age: Optional[float], sex: Optional[str]) -> Dict[Tuple, Tuple]:
+        """Memo of (raw name, raw unit) -> lookup() result for one patient profile."""
+        table = self._limits.get((age, sex))
+        if table is None:
+            if len(self._limits) >= 64:
+                self._limits.clear()
+            table = self._limits[(age, sex)] = {}
+        elif len(table) > 10000:
+            # Lab names come from the LLM, so keep the memo from growing without bound.
+            table.clear()
+        return table
+
+def normalize_name(name: str) -> str:
+    return " ".join(name.lower().replace(",", " ").split())
+
+@lru_cache(maxsize=256)
+def normalize_unit(unit: str) -> str:
+    unit = unit.strip().lower().replace(" ", "")
+    unit = unit.replace("µ", "u").replace("μ", "u")
+    unit = unit.replace("x10", "10").replace("*10", "10").replace("e3/", "^3/").replace("e9/", "^9/")
+    return unit
+
+# Words that turn an analyte name into a different quantity ("creatinine clearance").
+TEXT_QUALIFIERS = r"a1c|clearance|ratio|score|index"
+# Words allowed between an analyte name and its value in free text, alone or chained
+# ("Potassium level of 6.3", "Potassium elevated at 6.2").
+TEXT_SEPARATORS = (
+    r"was|is|of|at|level|levels|result|value|"
+    r"elevated|high|low|increased|decreased|raised|reduced"
+)
+
+def compile_rules(table: List[Dict[str, Any]]) -> RuleIndex:
+    """Builds the lookup index (synonym -> analyte) and the findings regex from a table."""
+    by_name = {}
+    text_synonyms = []
+    for entry in table:
+        rules = tuple(sorted(
+            (
+                CriticalRule(
+                    low=r.get("low"), high=r.get("high"), sex=r.get("sex"),
+                    min_age=r.get("min_age"), max_age=r.get("max_age"),
+                )
+                for r in entry["rules"]
+            ),
+            key=lambda r: r.specificity,
+            reverse=True,
+        ))
+        analyte = CompiledAnalyte(
+            name=entry["analyte"],
+            unit=normalize_unit(entry["unit"]),
+            conversions={normalize_unit(u): f for u, f in entry.get("conversions", {}).items()},
+            rules=rules,
+        )
+        for synonym in [entry["analyte"], *entry.get("synonyms", [])]:
+            key = normalize_name(synonym)
+            by_name[key] = analyte
+            # Very short abbreviations ("k", "na") are too ambiguous to look for in prose;
+            # "k+" and "na+" are not.
+            if len(key) >= 3 or key.endswith("+"):
+                text_synonyms.append(key)
+
+    text_pattern = None
+    if text_synonyms:
+        alternation = "|".join(re.escape(s) for s in sorted(set(text_synonyms), key=len, reverse=True))
+        # The value must follow the name directly, after at most a few separators:
+        # "Potassium 6.2", "Potassium: 6.2", "Potassium - 6.5", "Elevated potassium (6.2",
+        # "Potassium level of 6.3". Anything else between them ("Hemoglobin A1c 6.5",
+        # "Potassium on 12/03 was 4.1") is a different quantity or not a value at all.
+        text_pattern = re.compile(
+            rf"(?<![\w+])({alternation})(?![\w+])(?!\s*(?:{TEXT_QUALIFIERS})\b)"
+            rf"(?:\s*(?:[:=(\-–]|\b(?:{TEXT_SEPARATORS})\b)){{0,3}}\s*"
+            r"(\d+(?:\.\d+)?)(?![\d/]|\.\d)\s*(%|[a-z0-9µμ^*.]*/[a-zµμ]+)?",
+            re.IGNORECASE,
+        )
+    return RuleIndex(by_name=by_name, text_pattern=text_pattern)
+
+@lru_cache(maxsize=1)
+def get_rule_index() -> RuleIndex:
+    """Returns the compiled index for the configured critical-value table."""
+    path = os.getenv("CRITICAL_VALUES_FILE")
+    if path:
+        with open(path, "r") as f:
+            return compile_rules(json.load(f))
+    return compile_rules(CRITICAL_VALUES)
+
+def analyte_key(name: str) -> str:
+    """Stable lookup key for a lab name: the canonical analyte if known, else the normalised name."""
+    analyte = get_rule_index().resolve(name)
+    return analyte.name.lower() if analyte else normalize_name(name)
+
+def _get(obj, name):
+    return obj.get(name) if isinstance(obj, dict) else getattr(obj, name, None)
+
+def _rows(labs: Iterable[Any]) -> List[Tuple]:
+    labs = labs if isinstance(labs, list) else list(labs)
+    if labs and isinstance(labs[0], dict):
+        return [(lab.get("name"), lab.get("value"), lab.get("unit"), lab.get("flag")) for lab in labs]
+    return [(lab.name, lab.value, lab.unit, lab.flag) for lab in labs]
+
+def evaluate_labs(
+    labs: Iterable[Any],
+    age: Optional[float] = None,
+    sex: Optional[str] = None,
+    index: Optional[RuleIndex] = None,
+) -> Tuple[List[str], set]:
+    """
+    Evaluates a batch of lab rows (LabResult objects or plain dicts) against the index.
+    Returns the flag messages and the set of analytes that had a usable value.
+    """
+    index = index or get_rule_index()
+    limits = index.limits_table(age, sex)
+    flags = []
+    seen = set()
+    for name, value, unit, flag in _rows(labs):
+        if name and value is not None:
+            key = (name, unit)
+            entry = limits.get(key)
+            if entry is None:
+                entry = limits[key] = index.lookup(name, unit, age, sex)
+            if entry:
+                analyte_name, low, high = entry
+                seen.add(analyte_name)
+                if high is not None and value > high:
+                    flags.append(f"CRITICAL: {name} {value} (High)")
+                elif low is not None and value < low:
+                    flags.append(f"CRITICAL: {name} {value} (Low)")
+
+        if flag == "CRITICAL":
+            flags.append(f"REPORTED CRITICAL: {name} {value}")
+    return flags, seen
+
+def evaluate_findings(
+    findings: Iterable[str],
+    age: Optional[float] = None,
+    sex: Optional[str] = None,
+    skip: Optional[set] = None,
+    index: Optional[RuleIndex] = None,
+) -> List[str]:
+    """Looks for analyte values quoted in free-text findings. Analytes in `skip` are ignored."""
+    index = index or get_rule_index()
+    if index.text_pattern is None:
+        return []
+    skip = skip or set()
+    flags = []
+    for finding in findings:
+        for match in index.text_pattern.finditer(finding):
+            analyte = index.by_name[normalize_name(match.group(1))]
+            if analyte.name in skip:
+                continue
+            value = float(match.group(2))
+            canonical = analyte.to_canonical(value, match.group(3))
+            if canonical is None:
+                # Quoted in a unit we cannot convert from; a guess could raise a false alarm.
+                continue
+            rule = analyte.rule_for(age, sex)
+            if rule is None:
+                continue
+            if rule.high is not None and canonical > rule.high:
+                flags.append(f"CRITICAL: {analyte.name} {value} (High) noted in findings")
+            elif rule.low is not None and canonical < rule.low:
+                flags.append(f"CRITICAL: {analyte.name} {value} (Low) noted in findings")
+    return flags
+
+def evaluate_extraction(extraction: Any, age: Optional[float] = None, sex: Optional[str] = None) -> List[str]:
+    """Runs every red-flag check over a ReportExtraction (or its dict form)."""
+    flags, seen = evaluate_labs(_get(extraction, "labs") or [], age=age, sex=sex)
+    # Structured labs take precedence over the same analyte quoted in prose.
+    flags += evaluate_findings(_get(extraction, "findings") or [], age=age, sex=sex, skip=seen)
+    for val in _get(extraction, "critical_values") or []:
+        flags.append(f"REPORTED CRITICAL: {val}")
+    return list(dict.fromkeys(flags))
+
+def audit_reports(entries: Iterable[Dict[str, Any]], age: Optional[float] = None, sex: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Re-runs the current critical-value table over stored history entries.
+    Returns one row per report that raises at least one flag.
+    """
+    results = []
+    for entry in entries:
+        extraction = (entry.get("full_data") or {}).get("extraction") or {}
+        flags = evaluate_extraction(extraction, age=age, sex=sex)
+        if flags:
+            results.append({
+                "id": entry.get("id"),
+                "timestamp": entry.get("timestamp"),
+                "red_flags": flags,
+            })
+    return results
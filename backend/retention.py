@@ -0,0 +1,257 @@
+import gzip
+import json
+import os
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+# Retention for the history store. Compaction moves reports that fall outside the
+# retention policy from the hot history file into gzip-compressed JSON-lines segments
+# under the archive directory, so the hot file (read on every request) stays bounded.
+# Archived reports can still be opened by id (index.json maps each id to its segment),
+# stay in the search index, and their lab values stay in the trend store (each segment has a small sidecar with
+# just the lab rows, so trends do not have to decompress whole reports).
+#
+#   HISTORY_MAX_ENTRIES=0                  keep at most this many reports hot (0 = no limit)
+#   HISTORY_MAX_AGE_DAYS=0                 archive reports older than this (0 = no limit)
+#   HISTORY_COMPACTION_INTERVAL_SECONDS=0  run compaction in the background this often (0 = off)
+#   HISTORY_ARCHIVE_DIR                    default: "archive" next to the history file
+MAX_ENTRIES = int(os.getenv("HISTORY_MAX_ENTRIES", "0"))
+MAX_AGE_DAYS = float(os.getenv("HISTORY_MAX_AGE_DAYS", "0"))
+COMPACTION_INTERVAL = float(os.getenv("HISTORY_COMPACTION_INTERVAL_SECONDS", "0"))
+
+_status_lock = threading.Lock()
+_status: Dict[str, Any] = {"state": "idle"}
+_run_lock = threading.Lock()
+
+def archive_dir() -> str:
+    from . import storage
+    return os.getenv("HISTORY_ARCHIVE_DIR") or os.path.join(os.path.dirname(storage.HISTORY_FILE), "archive")
+
+def _manifest_path() -> str:
+    return os.path.join(archive_dir(), "manifest.json")
+
+def load_manifest() -> Dict[str, Any]:
+    """Lists archive segments: file name, seq range and report count of each."""
+    try:
+        with open(_manifest_path()) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"segments": []}
+
+def _index_path() -> str:
+    return os.path.join(archive_dir(), "index.json")
+
+_cache_lock = threading.Lock()
+_cache: Dict[str, Any] = {}
+
+def _cached(path: str, load):
+    """Returns load(), re-running it only when the file at `path` has changed."""
+    try:
+        st = os.stat(path)
+        key = (st.st_ino, st.st_mtime_ns, st.st_size)
+    except FileNotFoundError:
+        key = None
+    with _cache_lock:
+        hit = _cache.get(path)
+        if hit is not None and hit[0] == key:
+            return hit[1]
+    value = load()
+    with _cache_lock:
+        _cache[path] = (key, value)
+    return value
+
+def load_index() -> Dict[str, str]:
+    """Maps each archived report id to the segment file holding it."""
+    def load():
+        try:
+            with open(_index_path()) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            # Archives written before the index existed: build it from the segments once.
+            return {
+                entry["id"]: segment["file"]
+                for segment in load_manifest()["segments"]
+                for entry in _read_segment(segment["file"])
+            }
+    return _cached(_index_path(), load)
+
+def _atomic_write(path: str, data: bytes):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".archive-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def last_archived_seq() -> int:
+    segments = load_manifest()["segments"]
+    return max((s["last_seq"] for s in segments), default=0)
+
+def _expired(history: List[Dict[str, Any]], max_entries: int, max_age_days: float, now: datetime) -> int:
+    """Number of leading (oldest) entries that fall outside the policy."""
+    count = 0
+    if max_entries and len(history) > max_entries:
+        count = len(history) - max_entries
+    if max_age_days:
+        cutoff = (now - timedelta(days=max_age_days)).isoformat()
+        while count < len(history) and history[count]["timestamp"] < cutoff:
+            count += 1
+    return count
+
+def _set_status(**fields):
+    with _status_lock:
+        _status.update(fields)
+
+def get_status() -> Dict[str, Any]:
+    """Progress of the current (or last) compaction run, plus the configured policy."""
+    with _status_lock:
+        status = dict(_status)
+    status["policy"] = {
+        "max_entries": MAX_ENTRIES,
+        "max_age_days": MAX_AGE_DAYS,
+        "interval_seconds": COMPACTION_INTERVAL,
+    }
+    return status
+
+def compact(max_entries: Optional[int] = None, max_age_days: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Archives every report outside the retention policy and rewrites the hot history
+    file without them. The segment is written before the history file is replaced, so
+    a crash in between leaves a report in both places rather than in neither.
+    """
+    from . import storage
+
+    max_entries = MAX_ENTRIES if max_entries is None else max_entries
+    max_age_days = MAX_AGE_DAYS if max_age_days is None else max_age_days
+    with _run_lock:
+        _set_status(state="running", phase="scanning", started_at=datetime.now().isoformat(),
+                    finished_at=None, scanned=0, archived=0, kept=0, segment=None, error=None)
+        try:
+            with storage._history_lock():
+                history = storage._load_history(strict=True)
+                # Pin positional sequence numbers before any entry is removed.
+                for index, item in enumerate(history):
+                    item["seq"] = storage._entry_seq(item, index)
+                history.sort(key=lambda item: item["seq"])
+                count = _expired(history, max_entries, max_age_days, datetime.now())
+                _set_status(scanned=len(history))
+                expired, kept = history[:count], history[count:]
+
+                segment = None
+                if expired:
+                    _set_status(phase="archiving")
+                    segment = _write_segment(expired)
+                    _set_status(phase="rewriting", segment=segment)
+                    storage._save_history(kept)
+
+            result = {"archived": len(expired), "kept": len(kept), "segment": segment}
+            _set_status(state="done", phase=None, finished_at=datetime.now().isoformat(), **result)
+            return result
+        except Exception as e:
+            _set_status(state="failed", finished_at=datetime.now().isoformat(), error=str(e))
+            raise
+
+def _lab_rows(entry: Dict[str, Any]) -> Dict[str, Any]:
+    """The parts of a history entry the lab trend store reads."""
+    labs = ((entry.get("full_data") or {}).get("extraction") or {}).get("labs") or []
+    return {"id": entry["id"], "timestamp": entry["timestamp"], "full_data": {"extraction": {"labs": labs}}}
+
+def _write_segment(entries: List[Dict[str, Any]]) -> str:
+    """Writes one gzip JSON-lines segment and its lab sidecar, and registers them."""
+    first, last = entries[0]["seq"], entries[-1]["seq"]
+    name = f"segment-{first:010d}-{last:010d}.jsonl.gz"
+    labs_name = f"labs-{first:010d}-{last:010d}.jsonl.gz"
+    lines = "".join(json.dumps(entry) + "\n" for entry in entries)
+    _atomic_write(os.path.join(archive_dir(), name), gzip.compress(lines.encode("utf-8")))
+    lab_lines = "".join(json.dumps(_lab_rows(entry)) + "\n" for entry in entries)
+    _atomic_write(os.path.join(archive_dir(), labs_name), gzip.compress(lab_lines.encode("utf-8")))
+
+    index = dict(load_index())
+    index.update((entry["id"], name) for entry in entries)
+    _atomic_write(_index_path(), json.dumps(index).encode("utf-8"))
+
+    manifest = load_manifest()
+    manifest["segments"] = [s for s in manifest["segments"] if s["file"] != name]
+    manifest["segments"].append({
+        "file": name, "labs_file": labs_name, "first_seq": first, "last_seq": last, "count": len(entries),
+        "first_timestamp": entries[0]["timestamp"], "last_timestamp": entries[-1]["timestamp"],
+    })
+    _atomic_write(_manifest_path(), json.dumps(manifest, indent=2).encode("utf-8"))
+    return name
+
+def _read_segment(name: str) -> List[Dict[str, Any]]:
+    try:
+        with gzip.open(os.path.join(archive_dir(), name), "rt", encoding="utf-8") as f:
+            return [json.loads(line) for line in f]
+    except FileNotFoundError:
+        return []
+
+def find_archived(report_id: str) -> Optional[Dict[str, Any]]:
+    """Looks a report up in the archive; ids that were never archived cost one dict lookup."""
+    name = load_index().get(report_id)
+    if name is None:
+        return None
+    try:
+        with gzip.open(os.path.join(archive_dir(), name), "rt", encoding="utf-8") as f:
+            for line in f:
+                # Cheap substring test before paying for a full parse.
+                if report_id in line:
+                    entry = json.loads(line)
+                    if entry["id"] == report_id:
+                        return entry
+    except FileNotFoundError:
+        pass
+    return None
+
+def iter_archived():
+    """Every archived report, oldest segment first (full scan; used to rebuild indexes)."""
+    for segment in sorted(load_manifest()["segments"], key=lambda s: s["first_seq"]):
+        yield from _read_segment(segment["file"])
+
+def archived_lab_entries() -> List[Dict[str, Any]]:
+    """Lab rows of every archived report, oldest segment first, for the trend store."""
+    def load():
+        entries = []
+        for segment in sorted(load_manifest()["segments"], key=lambda s: s["first_seq"]):
+            entries.extend(_read_segment(segment.get("labs_file", segment["file"])))
+        return entries
+    return _cached(_manifest_path(), load)
+
+def start_compaction_in_background(**policy) -> bool:
+    """Starts a compaction run on a thread; False if one is already running."""
+    if _run_lock.locked():
+        return False
+
+    def run():
+        try:
+            compact(**policy)
+        except Exception as e:
+            print(f"History compaction failed: {e}")
+
+    threading.Thread(target=run, name="history-compaction", daemon=True).start()
+    return True
+
+def start_scheduler(stop: threading.Event) -> Optional[threading.Thread]:
+    """Runs compaction every COMPACTION_INTERVAL seconds until `stop` is set."""
+    if COMPACTION_INTERVAL <= 0 or not (MAX_ENTRIES or MAX_AGE_DAYS):
+        return None
+
+    def loop():
+        while not stop.wait(COMPACTION_INTERVAL):
+            try:
+                compact()
+            except Exception as e:
+                print(f"History compaction failed: {e}")
+
+    thread = threading.Thread(target=loop, name="history-compaction-scheduler", daemon=True)
+    thread.start()
+    return thread
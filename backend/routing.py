@@ -0,0 +1,107 @@
+import contextvars
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+# Per-stage model routing for LLM calls (stages: ocr, extraction, patient, clinician, rewrite).
+#
+#   OPENAI_MODEL_<STAGE>             model for one stage (default: OPENAI_MODEL)
+#   OPENAI_FAST_MODEL[_<STAGE>]      model to downgrade to under load (default: no downgrade)
+#   LLM_MAX_INFLIGHT                 downgrade when this many LLM calls are in flight (0 = off)
+#   LLM_LATENCY_SLO_SECONDS[_<STAGE>] downgrade when the primary model's recent p95 exceeds this (0 = off)
+#   LLM_DOWNGRADE_COOLDOWN_SECONDS   how long a stage stays downgraded once triggered
+MAX_INFLIGHT = int(os.getenv("LLM_MAX_INFLIGHT", "0"))
+DOWNGRADE_COOLDOWN = float(os.getenv("LLM_DOWNGRADE_COOLDOWN_SECONDS", "30"))
+LATENCY_WINDOW = 20
+LATENCY_MIN_SAMPLES = 5
+
+_lock = threading.Lock()
+_inflight = 0
+_downgraded_until: Dict[str, float] = {}
+_primary_latency: Dict[str, deque] = defaultdict(lambda: deque(maxlen=LATENCY_WINDOW))
+_stats = defaultdict(int)
+
+# Routing decisions made while serving the current analysis (see start_routing_log).
+_routing_log: contextvars.ContextVar[Optional[List[Dict[str, str]]]] = contextvars.ContextVar("routing_log", default=None)
+
+def _env(name: str, stage: str) -> Optional[str]:
+    return os.getenv(f"{name}_{stage.upper()}") or os.getenv(name)
+
+def _latency_slo(stage: str) -> float:
+    return float(_env("LLM_LATENCY_SLO_SECONDS", stage) or 0)
+
+def _p95(samples) -> Optional[float]:
+    if len(samples) < LATENCY_MIN_SAMPLES:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+def select_model(stage: str, default_model: str) -> Tuple[str, str]:
+    """Returns (model, reason) for the next call of this stage."""
+    primary = os.getenv(f"OPENAI_MODEL_{stage.upper()}") or default_model
+    fast = _env("OPENAI_FAST_MODEL", stage)
+    if not fast or fast == primary:
+        return primary, "configured"
+
+    now = time.monotonic()
+    with _lock:
+        if _downgraded_until.get(stage, 0) > now:
+            return fast, "downgraded (cooldown)"
+
+        slo = _latency_slo(stage)
+        p95 = _p95(_primary_latency[stage]) if slo else None
+        if MAX_INFLIGHT and _inflight >= MAX_INFLIGHT:
+            reason = f"downgraded: {_inflight} calls in flight (limit {MAX_INFLIGHT})"
+        elif p95 is not None and p95 > slo:
+            reason = f"downgraded: p95 latency {p95:.1f}s over SLO {slo:.1f}s"
+            # Start afresh so the primary is judged on new samples once the cooldown ends.
+            _primary_latency[stage].clear()
+        else:
+            return primary, "configured"
+        _downgraded_until[stage] = now + DOWNGRADE_COOLDOWN
+        _stats["downgrades"] += 1
+    return fast, reason
+
+@contextmanager
+def track_call(stage: str, model: str, default_model: str):
+    """Counts the call as in flight and feeds the primary model's latency window."""
+    global _inflight
+    primary = os.getenv(f"OPENAI_MODEL_{stage.upper()}") or default_model
+    with _lock:
+        _inflight += 1
+        _stats[f"calls:{stage}:{model}"] += 1
+    start = time.perf_counter()
+    try:
+        yield
+        if model == primary:
+            with _lock:
+                _primary_latency[stage].append(time.perf_counter() - start)
+    finally:
+        with _lock:
+            _inflight -= 1
+
+def start_routing_log() -> List[Dict[str, str]]:
+    """Starts collecting routing decisions for the current context and returns the list."""
+    log: List[Dict[str, str]] = []
+    _routing_log.set(log)
+    return log
+
+def record_decision(stage: str, model: str, reason: str):
+    log = _routing_log.get()
+    if log is not None:
+        entry = {"stage": stage, "model": model, "reason": reason}
+        if entry not in log:
+            log.append(entry)
+
+def get_stats() -> Dict[str, object]:
+    now = time.monotonic()
+    with _lock:
+        return {
+            "inflight": _inflight,
+            "downgrades": _stats["downgrades"],
+            "downgraded_stages": sorted(s for s, until in _downgraded_until.items() if until > now),
+            "calls": {k.split(":", 1)[1]: v for k, v in _stats.items() if k.startswith("calls:")},
+        }
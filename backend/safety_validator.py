@@ -40,6 +40,126 @@ ALL_BLOCKS = [
     ("PHRASING", BLOCK_PHRASING)
 ]
 
+COMPILED_BLOCKS = [
+    (category, pattern, re.compile(pattern))
+    for category, regexes in ALL_BLOCKS
+    for pattern in regexes
+]
+
+# Deterministic fixes for the purely mechanical violations, using the approved neutral
+# phrases from PATIENT_PROMPT / SAFETY_EDITOR_PROMPT. Wording is swapped in place;
+# reassurance, advice and leading questions cannot be reworded that way, so the whole
+# sentence containing them is replaced.
+REVIEW_SENTENCE = "These findings are typically reviewed by a healthcare professional."
+
+# Each rewrite lists the blocklist patterns it removes. Only "dangerously high/low" can
+# be reworded in place; used as an adjective ("a life-threatening arrhythmia"), the
+# severity words carry a prognosis, so their sentence is replaced.
+PHRASE_REWRITES = [
+    ([], re.compile(r"\bdangerously\s+(high|low)\b", re.IGNORECASE), r"flagged as \1 based on the reference range provided"),
+    ([r"warrants clinician review"], re.compile(r"warrants clinician review", re.IGNORECASE),
+     "is typically reviewed by a healthcare professional"),
+]
+_REASSURANCE = [r"no need to worry", r"nothing to worry", r"you're fine", r"you are fine", r"no issues", r"no problems"]
+SENTENCE_REWRITES = [
+    ([r"\bdangerous(ly)?\b", r"\blife-threatening\b"],
+     re.compile(r"\b(?:dangerous(?:ly)?|life-threatening)\b", re.IGNORECASE), REVIEW_SENTENCE),
+    (_REASSURANCE, re.compile("|".join(_REASSURANCE), re.IGNORECASE), REVIEW_SENTENCE),
+    (BLOCK_LIFESTYLE, re.compile("|".join(BLOCK_LIFESTYLE), re.IGNORECASE),
+     "Any next steps are typically discussed with a healthcare professional."),
+    ([r"affect my health"], re.compile(r"affect my health", re.IGNORECASE),
+     "How is this result interpreted in the context of my medical history and symptoms?"),
+    ([r"what does .* mean"], re.compile(r"\bwhat does .* mean", re.IGNORECASE),
+     "Can you walk me through what the report states about this finding?"),
+]
+# Blocklist patterns the rewrites above can remove. Anything else (e.g. "emergency",
+# "severe risk") still needs the model to rewrite it.
+LOCALLY_REWRITABLE = frozenset(
+    pattern for covers, _, _ in PHRASE_REWRITES + SENTENCE_REWRITES for pattern in covers
+)
+# A period ends a sentence unless it is a decimal point ("6.2") or closes a common
+# abbreviation ("Dr. Smith").
+ABBREVIATIONS = ("Dr", "Mr", "Mrs", "Ms", "Prof", "St", "vs", "approx", "e.g", "i.e", "etc")
+_SENTENCES = re.compile(
+    r"\s*(?:[^.!?]|(?<=\d)\.(?=\d)|\.(?=[a-z]\.)|"
+    + "|".join(rf"(?<=\b{re.escape(a)})\." for a in ABBREVIATIONS)
+    + r")+[.!?]*",
+    re.IGNORECASE,
+)
+# Substrings at least one of which every rewrite needs; most strings contain none, and
+# `in` checks are far cheaper than running the case-insensitive patterns.
+_TRIGGERS = (
+    "danger", "life-threatening", "clinician review", "worry", "fine", "no issues", "no problems",
+    "diet", "lifestyle", "avoid foods", "water", "salt", "affect my health", "what does",
+)
+
+def _rewrite_text(text: str):
+    lowered = text.lower()
+    if not any(trigger in lowered for trigger in _TRIGGERS):
+        return text, 0
+    total = 0
+    for _, regex, replacement in PHRASE_REWRITES:
+        text, n = regex.subn(replacement, text)
+        total += n
+    if not any(regex.search(text) for _, regex, _ in SENTENCE_REWRITES):
+        return text, total
+    sentences = []
+    for sentence in _SENTENCES.findall(text):
+        for _, regex, replacement in SENTENCE_REWRITES:
+            if regex.search(sentence):
+                lead = sentence[:len(sentence) - len(sentence.lstrip())]
+                sentence = lead + replacement
+                total += 1
+                break
+        sentences.append(sentence)
+    return "".join(sentences), total
+
+def rewrite_locally(value):
+    """
+    Applies the local rewrites to every string in a JSON-like structure (e.g. a
+    model_dump()). Returns (new value, number of substitutions). The replacement
+    phrases are English, so this is only used for English output.
+    """
+    if isinstance(value, str):
+        return _rewrite_text(value)
+    if isinstance(value, list):
+        results = [rewrite_locally(item) for item in value]
+        return [r[0] for r in results], sum(r[1] for r in results)
+    if isinstance(value, dict):
+        results = {key: rewrite_locally(item) for key, item in value.items()}
+        return {key: r[0] for key, r in results.items()}, sum(r[1] for r in results.values())
+    return value, 0
+
+class SafetyViolation(Exception):
+    """Raised when a streamed generation trips a blocklist before it has finished."""
+
+    def __init__(self, violations: list, partial_text: str):
+        super().__init__(f"Safety violation in streamed output: {violations}")
+        self.violations = violations
+        self.partial_text = partial_text
+
+class StreamingSafetyChecker:
+    """
+    Applies the blocklists to text as it streams in. Each call to feed() rescans only
+    the new text plus a trailing overlap, so phrases split across chunks are still
+    caught without re-reading the whole buffer every time.
+    """
+    OVERLAP = 200
+
+    def __init__(self):
+        self.buffer = ""
+        self._scanned = 0
+
+    def feed(self, delta: str) -> list:
+        self.buffer += delta
+        window = self.buffer[max(0, self._scanned - self.OVERLAP):].lower()
+        self._scanned = len(self.buffer)
+        return [
+            {"rule": category, "match": pattern}
+            for category, pattern, regex in COMPILED_BLOCKS
+            if regex.search(window)
+        ]
+
 def validate_output(text: str) -> dict:
     """
     Validates the text against safety rules.
@@ -53,10 +173,9 @@ def validate_output(text: str) -> dict:
     violations = []
     text_lower = text.lower()
     
-    for category, regexes in ALL_BLOCKS:
-        for pattern in regexes:
-            if re.search(pattern, text_lower):
-                violations.append({"rule": category, "match": pattern})
+    for category, pattern, regex in COMPILED_BLOCKS:
+        if regex.search(text_lower):
+            violations.append({"rule": category, "match": pattern})
 
     return {
         "is_safe": len(violations) == 0,
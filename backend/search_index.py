@@ -0,0 +1,221 @@
+import json
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional
+
+# SQLite side index over the history store. The JSON history stays the source of
+# truth; this file can be deleted at any time and is rebuilt from it on next use.
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    rowid INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    timestamp TEXT NOT NULL,
+    report_type TEXT,
+    red_flags TEXT
+);
+CREATE TABLE IF NOT EXISTS report_labs (
+    report_rowid INTEGER NOT NULL,
+    analyte TEXT NOT NULL,
+    flag TEXT,
+    critical INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_labs_analyte_flag ON report_labs(analyte, flag, report_rowid);
+CREATE INDEX IF NOT EXISTS idx_labs_analyte_critical ON report_labs(analyte, critical, report_rowid);
+CREATE INDEX IF NOT EXISTS idx_labs_report ON report_labs(report_rowid, analyte);
+CREATE VIRTUAL TABLE IF NOT EXISTS reports_fts USING fts5(
+    original_text, findings, labs, red_flags,
+    tokenize = 'porter unicode61'
+);
+"""
+
+_lock = threading.Lock()
+_connections: Dict[str, sqlite3.Connection] = {}
+# Index paths where a write failed, so some reports may be missing.
+_stale: set = set()
+
+def _index_path() -> str:
+    from . import storage
+    return os.getenv("SEARCH_INDEX_FILE") or os.path.join(os.path.dirname(storage.HISTORY_FILE), "search.db")
+
+def _connect() -> sqlite3.Connection:
+    """Returns the shared connection for the current index path. Caller must hold _lock."""
+    path = _index_path()
+    conn = _connections.get(path)
+    if conn is not None:
+        return conn
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Several worker processes may share this file; wait for their write locks.
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(_SCHEMA)
+    _connections[path] = conn
+    # Covers first use, a deleted index, a backfill that crashed half way and reports
+    # other processes failed to index.
+    _reconcile(conn)
+    return conn
+
+def _reconcile(conn: sqlite3.Connection):
+    """
+    Indexes every report of the history store and its archive that the index is
+    missing. Archived reports come first so a fresh backfill keeps rowids in save order;
+    a report indexed late sorts as newer than it is.
+    """
+    from .retention import _read_segment, load_index
+    from .storage import _load_history
+    indexed = {row[0] for row in conn.execute("SELECT id FROM reports")}
+    archived = load_index()
+    segments = sorted({segment for report_id, segment in archived.items() if report_id not in indexed})
+    for segment in segments:
+        for entry in _read_segment(segment):
+            _insert(conn, entry)
+    for entry in _load_history():
+        if entry["id"] not in indexed:
+            _insert(conn, entry)
+    conn.commit()
+    _stale.discard(_index_path())
+
+def _insert(conn: sqlite3.Connection, entry: Dict[str, Any]):
+    from .red_flags import analyte_key, evaluate_labs
+
+    data = entry.get("full_data") or {}
+    extraction = data.get("extraction") or {}
+    labs = extraction.get("labs") or []
+    red_flags = entry.get("red_flags") or []
+
+    cur = conn.execute(
+        "INSERT OR IGNORE INTO reports (id, timestamp, report_type, red_flags) VALUES (?, ?, ?, ?)",
+        (entry["id"], entry["timestamp"], entry.get("report_type"), json.dumps(red_flags)),
+    )
+    if cur.rowcount == 0:
+        return  # already indexed
+    rowid = cur.lastrowid
+
+    lab_rows = []
+    for lab in labs:
+        if not lab.get("name"):
+            continue
+        critical = lab.get("flag") == "CRITICAL" or bool(evaluate_labs([lab])[0])
+        lab_rows.append((rowid, analyte_key(lab["name"]), lab.get("flag"), int(critical)))
+    conn.executemany(
+        "INSERT INTO report_labs (report_rowid, analyte, flag, critical) VALUES (?, ?, ?, ?)",
+        lab_rows,
+    )
+    conn.execute(
+        "INSERT INTO reports_fts (rowid, original_text, findings, labs, red_flags) VALUES (?, ?, ?, ?, ?)",
+        (
+            rowid,
+            data.get("original_text") or "",
+            "\n".join(extraction.get("findings") or []),
+            "\n".join(f"{lab.get('name', '')} {lab.get('flag') or ''}" for lab in labs),
+            "\n".join(red_flags),
+        ),
+    )
+
+def index_report(entry: Dict[str, Any]):
+    """
+    Adds a single history entry to the search index. If that fails (e.g. a lock timeout
+    while another worker writes), the next call first indexes whatever is missing.
+    """
+    with _lock:
+        path = _index_path()
+        conn = None
+        try:
+            conn = _connect()
+            if path in _stale:
+                _reconcile(conn)
+            _insert(conn, entry)
+            conn.commit()
+        except Exception:
+            _stale.add(path)
+            if conn is not None:
+                conn.rollback()
+            raise
+
+def _fts_query(text: str) -> str:
+    # Quote every term so user input is never parsed as FTS5 syntax; terms are ANDed.
+    terms = [t.replace('"', '""') for t in text.split()]
+    return " ".join(f'"{t}"' for t in terms if t)
+
+def search_reports(
+    q: Optional[str] = None,
+    analyte: Optional[str] = None,
+    flag: Optional[str] = None,
+    red_flagged: Optional[bool] = None,
+    limit: int = 50,
+    offset: int = 0,
+) -> List[Dict[str, Any]]:
+    """
+    Returns history metadata (newest first) for reports matching every given filter.
+    `flag` applies to labs of `analyte` when both are given, otherwise to any lab;
+    flag="CRITICAL" also matches values the red-flag engine considers critical.
+    """
+    lab_where = []
+    lab_params: List[Any] = []
+    if analyte:
+        lab_where.append("l.analyte = ?")
+        from .red_flags import analyte_key
+        lab_params.append(analyte_key(analyte))
+    if flag:
+        flag = flag.upper()
+        if flag == "CRITICAL":
+            lab_where.append("l.critical = 1")
+        else:
+            lab_where.append("l.flag = ?")
+            lab_params.append(flag)
+
+    # Reports are indexed in save order, so rowid order is timestamp order. Every plan
+    # below walks an index in descending rowid order and stops after `limit` rows,
+    # instead of collecting all matches and sorting them.
+    where = []
+    params: List[Any] = []
+    fts = _fts_query(q) if q else ""
+    if fts:
+        sql = "SELECT r.id, r.timestamp, r.report_type, r.red_flags FROM reports_fts f JOIN reports r ON r.rowid = f.rowid"
+        where.append("reports_fts MATCH ?")
+        params.append(fts)
+        order = "f.rowid"
+    elif analyte:
+        sql = "SELECT r.id, r.timestamp, r.report_type, r.red_flags FROM report_labs l JOIN reports r ON r.rowid = l.report_rowid"
+        where += lab_where
+        params += lab_params
+        lab_where = []
+        order = "l.report_rowid"
+    else:
+        sql = "SELECT r.id, r.timestamp, r.report_type, r.red_flags FROM reports r"
+        order = "r.rowid"
+
+    if lab_where:
+        where.append("EXISTS (SELECT 1 FROM report_labs l WHERE l.report_rowid = r.rowid AND " + " AND ".join(lab_where) + ")")
+        params += lab_params
+
+    if red_flagged is not None:
+        where.append("r.red_flags != '[]'" if red_flagged else "r.red_flags = '[]'")
+
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    if order == "l.report_rowid":
+        sql += " GROUP BY l.report_rowid"  # a report may list the same analyte twice
+    sql += f" ORDER BY {order} DESC LIMIT ? OFFSET ?"
+    params += [limit, offset]
+
+    with _lock:
+        rows = _connect().execute(sql, params).fetchall()
+    return [
+        {"id": row[0], "timestamp": row[1], "report_type": row[2], "red_flags": json.loads(row[3])}
+        for row in rows
+    ]
+
+def rebuild_index():
+    """Drops and rebuilds the index from the history store and its archive."""
+    with _lock:
+        path = _index_path()
+        conn = _connections.pop(path, None)
+        if conn is not None:
+            conn.close()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        _connect()
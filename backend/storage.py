@@ -1,37 +1,76 @@
 import json
 import os
+import tempfile
+import threading
 import uuid
+from contextlib import contextmanager
 from datetime import datetime
 from typing import List, Optional, Dict, Any
 
+try:
+    import fcntl
+except ImportError:  # Windows: threads are still serialised, but run a single worker.
+    fcntl = None
+
 # Vercel Serverless environment has read-only filesystem except /tmp
 if os.environ.get("VERCEL"):
     HISTORY_FILE = "/tmp/history.json"
 else:
     HISTORY_FILE = os.path.join(os.path.dirname(__file__), "data", "history.json")
 
-def _load_history() -> List[Dict[str, Any]]:
+def _load_history(strict: bool = False) -> List[Dict[str, Any]]:
+    """Reads the history file. With strict=True errors propagate instead of yielding []."""
     if not os.path.exists(HISTORY_FILE):
         return []
     try:
         with open(HISTORY_FILE, "r") as f:
             return json.load(f)
     except Exception as e:
+        if strict:
+            raise
         print(f"Error loading history: {e}")
         return []
 
-def _save_history(history: List[Dict[str, Any]]):
+_thread_lock = threading.Lock()
+
+@contextmanager
+def _history_lock():
+    """
+    Serialises read-modify-write cycles on the history file across threads and across
+    uvicorn worker processes (flock on a sidecar lock file).
+    """
     os.makedirs(os.path.dirname(HISTORY_FILE), exist_ok=True)
-    with open(HISTORY_FILE, "w") as f:
-        json.dump(history, f, indent=2)
+    with _thread_lock:
+        with open(HISTORY_FILE + ".lock", "a") as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def _save_history(history: List[Dict[str, Any]]):
+    """Writes to a temp file and renames it over the old one, so readers never see a partial file."""
+    directory = os.path.dirname(HISTORY_FILE)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".history-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(history, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, HISTORY_FILE)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
 
 def save_report(api_response_dict: Dict[str, Any]) -> str:
     """
     Saves the analyzed report to history.
     Returns the generated report ID.
     """
-    history = _load_history()
-    
     report_id = str(uuid.uuid4())
     timestamp = datetime.now().isoformat()
     
@@ -45,10 +84,35 @@ def save_report(api_response_dict: Dict[str, Any]) -> str:
         "full_data": api_response_dict # Store the full response
     }
     
-    history.append(entry)
-    _save_history(history)
+    with _history_lock():
+        # Strict: an unreadable file must not be silently replaced by a one-entry history.
+        history = _load_history(strict=True)
+        version_before = get_history_version()
+        entry["seq"] = _latest_seq(history) + 1
+        history.append(entry)
+        _save_history(history)
+        version_after = get_history_version()
+
+    _update_derived_stores(entry, version_before, version_after)
     return report_id
 
+def _update_derived_stores(entry: Dict[str, Any], version_before: str, version_after: str):
+    """
+    Feeds a newly saved entry to the search index and lab time series.
+    Both are derived from the history file, so a failure here must not lose the report.
+    The versions let per-process caches tell whether another worker wrote in between.
+    """
+    try:
+        from .search_index import index_report
+        index_report(entry)
+    except Exception as e:
+        print(f"Error indexing report {entry['id']}: {e}")
+    try:
+        from .lab_series import add_report
+        add_report(entry, version_before, version_after)
+    except Exception as e:
+        print(f"Error adding report {entry['id']} to lab trends: {e}")
+
 def get_history_list() -> List[Dict[str, Any]]:
     """
     Returns a lightweight list of history items (without full data).
@@ -58,19 +122,67 @@ def get_history_list() -> List[Dict[str, Any]]:
     history.sort(key=lambda x: x["timestamp"], reverse=True)
     
     # Return only metadata
-    return [
-        {
-            "id": item["id"],
-            "timestamp": item["timestamp"],
-            "report_type": item["report_type"],
-            "red_flags": item["red_flags"]
-        }
-        for item in history
-    ]
+    return [_summary(item) for item in history]
+
+def _summary(item: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": item["id"],
+        "timestamp": item["timestamp"],
+        "report_type": item["report_type"],
+        "red_flags": item["red_flags"]
+    }
+
+def _entry_seq(item: Dict[str, Any], index: int) -> int:
+    # Entries written before sequence numbers existed are numbered by position.
+    return item.get("seq", index + 1)
+
+def _latest_seq(history: List[Dict[str, Any]]) -> int:
+    if history:
+        return _entry_seq(history[-1], len(history) - 1)
+    # Everything may have been archived; numbering continues after the archive.
+    from .retention import last_archived_seq
+    return last_archived_seq()
+
+def get_history_changes(since: Optional[int] = None, limit: int = 100) -> Dict[str, Any]:
+    """
+    Returns metadata for reports saved after cursor `since`, oldest first, at most `limit`
+    at a time. Clients keep the returned cursor and pass it back on the next call; no
+    cursor means a full listing. If the cursor is ahead of the history (the file was
+    replaced), `reset` is set and the listing starts over from the beginning.
+    """
+    history = _load_history()
+    latest = _latest_seq(history)
+    reset = since is not None and since > latest
+    if since is None or reset:
+        since = 0
+
+    changes = []
+    for index, item in enumerate(history):
+        seq = _entry_seq(item, index)
+        if seq > since:
+            changes.append({**_summary(item), "seq": seq})
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    cursor = changes[-1]["seq"] if changes else since
+    return {"changes": changes, "cursor": str(cursor), "has_more": has_more, "reset": reset}
+
+def get_history_version() -> str:
+    """
+    Returns a cheap token that changes on every write to the history file.
+    Used as a weak validator for the history list.
+    """
+    try:
+        st = os.stat(HISTORY_FILE)
+    except FileNotFoundError:
+        return "empty"
+    return f"{st.st_ino:x}-{st.st_mtime_ns:x}-{st.st_size:x}"
 
 def get_report_detail(report_id: str) -> Optional[Dict[str, Any]]:
     history = _load_history()
     for item in history:
         if item["id"] == report_id:
             return item["full_data"]
-    return None
+    # Reports moved out by retention compaction are still served from the archive.
+    from .retention import find_archived
+    archived = find_archived(report_id)
+    return archived["full_data"] if archived else None
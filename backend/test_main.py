@@ -52,3 +52,655 @@ def test_analyze_endpoint_failure_no_key():
         # The main app catches generic exceptions and returns 500
         # BUT for explicit LLM client missing (ValueError), we map to 503 now in main.py
         assert response.status_code == 503
+
+def test_history_etags(tmp_path):
+    with patch("backend.storage.HISTORY_FILE", str(tmp_path / "history.json")):
+        from backend.storage import save_report
+        report_id = save_report({"extraction": {"report_type": "Test"}, "red_flags": []})
+
+        listing = client.get("/history")
+        assert listing.status_code == 200
+        assert listing.headers["etag"].startswith('W/"')
+        again = client.get("/history", headers={"If-None-Match": listing.headers["etag"]})
+        assert again.status_code == 304
+
+        detail = client.get(f"/history/{report_id}", headers={"Accept-Encoding": "identity"})
+        assert detail.status_code == 200
+        assert detail.headers["etag"] == f'"{report_id}"'
+        again = client.get(f"/history/{report_id}", headers={"If-None-Match": detail.headers["etag"]})
+        assert again.status_code == 304
+        assert again.content == b""
+        # The body may be gzipped for this client, so the tag is weak for it.
+        gzipped = client.get(f"/history/{report_id}", headers={"Accept-Encoding": "gzip"})
+        assert gzipped.headers["etag"] == f'W/"{report_id}"'
+        assert "accept-encoding" in gzipped.headers["vary"].lower()
+
+def test_history_change_feed(tmp_path):
+    with patch("backend.storage.HISTORY_FILE", str(tmp_path / "history.json")):
+        from backend.storage import save_report
+        first = save_report({"extraction": {"report_type": "Lab"}, "red_flags": [], "original_text": "x" * 5000})
+
+        feed = client.get("/history/changes").json()
+        assert [c["id"] for c in feed["changes"]] == [first]
+        assert "full_data" not in feed["changes"][0]
+
+        ids = [save_report({"extraction": {"report_type": "Lab"}, "red_flags": []}) for _ in range(3)]
+        page = client.get("/history/changes", params={"since": feed["cursor"], "limit": 2}).json()
+        assert [c["id"] for c in page["changes"]] == ids[:2] and page["has_more"]
+        page = client.get("/history/changes", params={"since": page["cursor"]}).json()
+        assert [c["id"] for c in page["changes"]] == ids[2:] and not page["has_more"]
+
+        assert client.get("/history/changes", params={"since": page["cursor"]}).json()["changes"] == []
+        assert client.get("/history/changes", params={"since": "999"}).json()["reset"] is True
+        assert client.get("/history/changes", params={"since": "abc"}).status_code == 400
+
+def test_large_responses_are_gzipped(tmp_path):
+    with patch("backend.storage.HISTORY_FILE", str(tmp_path / "history.json")):
+        from backend.storage import save_report
+        report_id = save_report({"original_text": "Potassium 6.2 mmol/L\n" * 500, "red_flags": []})
+        response = client.get(f"/history/{report_id}", headers={"Accept-Encoding": "gzip"})
+        assert response.headers.get("content-encoding") == "gzip"
+
+def test_cold_start_import_budget():
+    # Run in a fresh interpreter so modules imported by this test session don't hide the cost.
+    import os
+    import subprocess
+    budget_ms = float(os.environ.get("COLD_START_BUDGET_MS", "1000"))
+    script = (
+        "import sys, time\n"
+        "t = time.perf_counter()\n"
+        "import backend.main\n"
+        "print((time.perf_counter() - t) * 1000)\n"
+        "print(','.join(m for m in ('openai', 'reportlab', 'pypdf', 'dotenv') if m in sys.modules))\n"
+    )
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    out = subprocess.run([sys.executable, "-c", script], cwd=root, capture_output=True, text=True, check=True)
+    elapsed_ms, heavy = out.stdout.splitlines()
+    assert heavy == "", f"Heavy modules imported at startup: {heavy}"
+    assert float(elapsed_ms) < budget_ms, f"Cold-start import took {elapsed_ms}ms (budget {budget_ms}ms)"
+
+def test_red_flags_units_and_qualifiers():
+    from backend.logic import check_red_flags
+    from backend.models import LabResult
+    extraction = ReportExtraction(
+        report_type="lab",
+        findings=["Glucose 2.0 mmol/L noted"],
+        impression=[],
+        labs=[
+            LabResult(name="Potassium, Serum", value=6.2, unit="mmol/L"),
+            LabResult(name="Sodium", value=135, unit="mEq/L"),
+            LabResult(name="Creatinine", value=400, unit="µmol/L"),
+        ],
+    )
+    flags = check_red_flags(extraction)
+    assert "CRITICAL: Potassium, Serum 6.2 (High)" in flags
+    assert "CRITICAL: Glucose 2.0 (Low) noted in findings" in flags
+    assert not any("Sodium" in f or "Creatinine" in f for f in flags)
+
+    # Infants have a higher potassium limit; children a lower creatinine one.
+    infant_flags = check_red_flags(extraction, age=0.5)
+    assert not any("Potassium" in f for f in infant_flags)
+    assert "CRITICAL: Creatinine 400.0 (High)" in infant_flags
+
+def test_red_flags_ignore_other_quantities_in_findings():
+    from backend.red_flags import evaluate_findings
+    assert evaluate_findings([
+        "Hemoglobin A1c 6.5%",
+        "Creatinine clearance 45 mL/min",
+        "Coronary calcium score 400",
+        "Potassium on 12/03 was 4.1",
+        "Glucose 40 mg/L",
+    ]) == []
+    assert evaluate_findings(["Potassium was 6.8."]) == ["CRITICAL: Potassium 6.8 (High) noted in findings"]
+
+def test_red_flags_findings_keep_baseline_potassium_phrasings():
+    # Every one of these was flagged by the original "potassium ... 6." rule.
+    from backend.red_flags import evaluate_findings
+    from backend.admission import classify
+    phrasings = [
+        "Potassium 6.2 mmol/L",
+        "Potassium: 6.2 mmol/L (Ref: 3.5-5.0)",
+        "Potassium elevated at 6.2 mmol/L",
+        "Elevated potassium (6.2 mmol/L)",
+        "Potassium level of 6.3 mmol/L",
+        "Potassium - 6.5 mmol/L",
+        "Serum potassium is 6.4",
+        "K+ 6.9 mmol/L",
+    ]
+    for text in phrasings:
+        assert len(evaluate_findings([text])) == 1, text
+        assert classify(text) == "critical", text
+
+def test_red_flag_audit_over_history():
+    from backend.red_flags import audit_reports
+    entries = [
+        {"id": "a", "timestamp": "t1", "full_data": {"extraction": {"findings": [], "labs": [{"name": "K", "value": 7.1, "unit": "mmol/L"}]}}},
+        {"id": "b", "timestamp": "t2", "full_data": {"extraction": {"findings": [], "labs": [{"name": "K", "value": 4.1, "unit": "mmol/L"}]}}},
+    ]
+    results = audit_reports(entries)
+    assert [r["id"] for r in results] == ["a"]
+    assert results[0]["red_flags"] == ["CRITICAL: K 7.1 (High)"]
+
+def test_search_index_recovers_reports_it_failed_to_index(tmp_path):
+    import sqlite3
+    with patch("backend.storage.HISTORY_FILE", str(tmp_path / "history.json")):
+        from backend import search_index
+        from backend.storage import save_report
+        with patch("backend.search_index._insert", side_effect=sqlite3.OperationalError("database is locked")):
+            missed = save_report({"original_text": "missed report", "red_flags": []})
+        assert client.get("/search", params={"q": "report"}).json() == []
+        saved = save_report({"original_text": "next report", "red_flags": []})
+        assert {r["id"] for r in client.get("/search", params={"q": "report"}).json()} == {missed, saved}
+
+        # A new connection (e.g. after a restart) also fills in what is missing.
+        with search_index._lock:
+            conn = search_index._connections.pop(search_index._index_path())
+            conn.execute("DELETE FROM reports WHERE id = ?", (missed,))
+            conn.commit()
+            conn.close()
+        assert {r["id"] for r in client.get("/search", params={"q": "report"}).json()} == {missed, saved}
+
+def test_search_by_analyte_flag_and_text(tmp_path):
+    with patch("backend.storage.HISTORY_FILE", str(tmp_path / "history.json")):
+        from backend.storage import save_report
+        critical_id = save_report({
+            "original_text": "Potassium 6.9 mmol/L, sample hemolyzed",
+            "extraction": {"report_type": "lab", "findings": [], "impression": [],
+                           "labs": [{"name": "Potassium, Serum", "value": 6.9, "unit": "mmol/L", "flag": "HIGH"}]},
+            "red_flags": ["CRITICAL: Potassium, Serum 6.9 (High)"],
+        })
+        normal_id = save_report({
+            "original_text": "Chest x-ray, lungs clear",
+            "extraction": {"report_type": "radiology", "findings": ["Lungs are clear"], "impression": [],
+                           "labs": [{"name": "K", "value": 4.2, "unit": "mmol/L", "flag": "NORMAL"}]},
+            "red_flags": [],
+        })
+
+        hits = client.get("/search", params={"analyte": "potassium", "flag": "CRITICAL"}).json()
+        assert [h["id"] for h in hits] == [critical_id]
+
+        hits = client.get("/search", params={"analyte": "K"}).json()
+        assert {h["id"] for h in hits} == {critical_id, normal_id}
+
+        hits = client.get("/search", params={"q": "lungs"}).json()
+        assert [h["id"] for h in hits] == [normal_id]
+
+        hits = client.get("/search", params={"red_flagged": True}).json()
+        assert [h["id"] for h in hits] == [critical_id]
+
+def test_lab_trend_converts_units_and_downsamples(tmp_path):
+    with patch("backend.storage.HISTORY_FILE", str(tmp_path / "history.json")):
+        from backend.storage import save_report
+        for value, unit in [(1.0, "mg/dL"), (1.2, "mg/dL"), (150.3, "umol/L"), (1.4, "mg/dL")]:
+            save_report({"extraction": {"report_type": "lab", "findings": [], "impression": [],
+                                        "labs": [{"name": "Creatinine", "value": value, "unit": unit}]},
+                         "red_flags": []})
+
+        trend = client.get("/trends/creatinine").json()
+        assert trend["unit"] == "mg/dl"
+        assert trend["total_points"] == 4
+        assert [round(p["value"], 1) for p in trend["points"]] == [1.0, 1.2, 1.7, 1.4]
+
+        reduced = client.get("/trends/Creat", params={"max_points": 2}).json()
+        assert reduced["downsampled"] is True
+        assert [p["count"] for p in reduced["points"]] == [2, 2]
+        assert reduced["points"][1]["max"] == trend["points"][2]["value"]
+
+        assert client.get("/trends/sodium").status_code == 404
+
+def test_long_reports_are_extracted_in_chunks():
+    from backend import llm_client
+    from backend.models import LabResult
+    report = "DISCHARGE SUMMARY\n\nFINDINGS:\n" + "Stable.\n" * 40 + "\nCHEMISTRY:\n" + "Potassium: 6.2 mmol/L\n" * 5
+
+    def fake_extract(chunk):
+        labs = [LabResult(name="Potassium", value=6.2, unit="mmol/L")] if "Potassium" in chunk else []
+        findings = ["Stable."] if "Stable." in chunk else []
+        return ReportExtraction(report_type="Unknown" if not labs else "lab", findings=findings,
+                                impression=[], labs=labs)
+
+    with patch.object(llm_client, "EXTRACTION_CHUNK_CHARS", 200), \
+         patch("backend.llm_client.get_client", return_value=MagicMock()), \
+         patch("backend.llm_client._extract_chunk", side_effect=fake_extract) as extract:
+        result = llm_client.extract_facts(report)
+
+    assert extract.call_count > 2
+    assert all(len(call.args[0]) <= 200 + 60 for call in extract.call_args_list)
+    assert result.report_type == "lab"
+    assert result.findings == ["Stable."]
+    assert len(result.labs) == 1
+
+def test_result_cache_shared_across_requests(tmp_path):
+    from backend import cache as cache_module
+    shared = cache_module.SQLiteCache(str(tmp_path / "cache.db"))
+    with patch("backend.storage.HISTORY_FILE", str(tmp_path / "history.json")), \
+         patch("backend.cache.get_result_cache", return_value=shared), \
+         patch("backend.logic.extract_facts", return_value=MOCK_EXTRACTION) as extract, \
+         patch("backend.logic.generate_patient_explanation", return_value=MOCK_PATIENT), \
+         patch("backend.logic.generate_clinician_summary", return_value=MOCK_CLINICIAN):
+        first = client.post("/analyze", json={"text": "Cached text", "mode": "patient"})
+        second = client.post("/analyze", json={"text": "Cached text", "mode": "patient"})
+
+    assert first.status_code == second.status_code == 200
+    assert extract.call_count == 1
+    assert first.json()["extraction"] == second.json()["extraction"]
+    assert first.json()["id"] != second.json()["id"]
+
+def test_concurrent_saves_do_not_lose_reports(tmp_path):
+    from concurrent.futures import ThreadPoolExecutor
+    with patch("backend.storage.HISTORY_FILE", str(tmp_path / "history.json")):
+        from backend.storage import save_report, get_history_list
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            ids = list(pool.map(lambda i: save_report({"red_flags": [], "extraction": {"report_type": str(i)}}), range(40)))
+        assert {item["id"] for item in get_history_list()} == set(ids)
+
+def test_multi_language_fan_out_extracts_once(tmp_path):
+    def explain(extraction, language="English"):
+        return MOCK_PATIENT.model_copy(update={"summary": f"Summary in {language}"})
+
+    with patch("backend.storage.HISTORY_FILE", str(tmp_path / "history.json")), \
+         patch("backend.logic.extract_facts", return_value=MOCK_EXTRACTION) as extract, \
+         patch("backend.logic.generate_patient_explanation", side_effect=explain) as patient, \
+         patch("backend.logic.generate_clinician_summary", return_value=MOCK_CLINICIAN) as clinician:
+        response = client.post("/analyze", json={"text": "Any text", "languages": ["Spanish", "Hindi", "Spanish"]})
+
+        assert response.status_code == 200
+        data = response.json()
+        assert extract.call_count == 1 and clinician.call_count == 1 and patient.call_count == 2
+        assert data["language"] == "Spanish"
+        assert data["patient_analysis"]["summary"] == "Summary in Spanish"
+        assert set(data["patient_variants"]) == {"Spanish", "Hindi"}
+        assert data["patient_variants"]["Hindi"]["summary"] == "Summary in Hindi"
+
+        stored = client.get(f"/history/{data['id']}").json()
+        assert stored["patient_variants"]["Hindi"]["summary"] == "Summary in Hindi"
+        assert client.get(f"/history/{data['id']}/pdf").status_code == 200
+
+def test_hedged_call_uses_faster_duplicate():
+    import threading, time
+    from backend import hedging
+    with patch.object(hedging, "_latencies", hedging.defaultdict(lambda: hedging.deque(maxlen=hedging.WINDOW))), \
+         patch.object(hedging, "_recent_hedged", hedging.deque([False] * 100, maxlen=hedging.WINDOW)), \
+         patch.object(hedging, "_stats", hedging.defaultdict(int)):
+        for _ in range(hedging.HEDGE_MIN_SAMPLES):
+            hedging.record_latency("test", 0.01)
+
+        calls, aborted = [], []
+        def slow_then_fast():
+            calls.append(1)
+            if len(calls) > 1:
+                return "hedge"
+            # The primary runs on the caller's thread and is aborted once the hedge wins.
+            stop = threading.Event()
+            hedging.on_cancel(stop.set)
+            aborted.append(stop.wait(0.5))
+            return "primary"
+
+        start = time.perf_counter()
+        assert hedging.hedged_call(slow_then_fast, "test", enabled=True) == "hedge"
+        assert time.perf_counter() - start < 0.4
+        assert aborted == [True]
+        stats = hedging.get_stats()
+        assert stats["hedges_fired"] == 1 and stats["hedge_wins"] == 1
+
+        # Results are validated whether or not a hedge was fired.
+        import pytest
+        with pytest.raises(ValueError):
+            hedging.hedged_call(lambda: "", "test", validate=bool, enabled=True)
+        with pytest.raises(ValueError):
+            hedging.hedged_call(lambda: "", "unhedged", validate=bool, enabled=True)
+
+        # Spend cap: with every recent call already hedged, no further hedge is fired.
+        hedging._recent_hedged.extend([True] * 100)
+        calls.clear()
+        assert hedging.hedged_call(slow_then_fast, "test", enabled=True) == "primary"
+        assert hedging.get_stats()["budget_skipped"] == 1
+
+def _fake_completion(**kwargs):
+    import json
+    system = kwargs["messages"][0]["content"]
+    if '"title": "ClinicianSummary"' in system:
+        payload = MOCK_CLINICIAN.model_dump()
+    elif '"title": "PatientExplanation"' in system:
+        payload = MOCK_PATIENT.model_dump()
+    else:
+        payload = MOCK_EXTRACTION.model_dump()
+    if kwargs.get("stream"):
+        return _FakeStream(json.dumps(payload))
+    response = MagicMock()
+    response.choices = [MagicMock()]
+    response.choices[0].message.content = json.dumps(payload)
+    return response
+
+class _FakeStream:
+    """Yields a completion in small deltas, like the OpenAI client with stream=True."""
+
+    def __init__(self, text, size=16):
+        self.deltas = [text[i:i + size] for i in range(0, len(text), size)]
+        self.sent = 0
+        self.closed = False
+
+    def __iter__(self):
+        for delta in self.deltas:
+            if self.closed:
+                return
+            self.sent += 1
+            chunk = MagicMock()
+            chunk.choices = [MagicMock()]
+            chunk.choices[0].delta.content = delta
+            yield chunk
+
+    def close(self):
+        self.closed = True
+
+def test_per_stage_model_routing_and_downgrade(tmp_path, monkeypatch):
+    from backend import routing
+    fake_client = MagicMock()
+    fake_client.chat.completions.create.side_effect = _fake_completion
+    monkeypatch.setenv("OPENAI_MODEL_EXTRACTION", "small-model")
+    monkeypatch.setenv("OPENAI_FAST_MODEL_PATIENT", "fast-model")
+    monkeypatch.setattr(routing, "_downgraded_until", {})
+
+    with patch("backend.storage.HISTORY_FILE", str(tmp_path / "history.json")), \
+         patch("backend.llm_client.get_client", return_value=fake_client):
+        data = client.post("/analyze", json={"text": "Any text", "mode": "patient"}).json()
+        models = {d["stage"]: d["model"] for d in data["routing"]}
+        assert models == {"extraction": "small-model", "patient": "gpt-4o", "clinician": "gpt-4o"}
+
+        # Queue depth over the limit moves stages with a fast model onto it.
+        monkeypatch.setattr(routing, "MAX_INFLIGHT", 4)
+        monkeypatch.setattr(routing, "_inflight", 10)
+        data = client.post("/analyze", json={"text": "Other text", "mode": "patient"}).json()
+        patient = next(d for d in data["routing"] if d["stage"] == "patient")
+        assert patient["model"] == "fast-model"
+        assert patient["reason"].startswith("downgraded")
+
+def test_streamed_generation_aborts_on_first_violation(tmp_path):
+    import json
+    unsafe = MOCK_PATIENT.model_copy(update={
+        "summary": "This means you have anemia.",
+        "what_this_means": ["Filler text that would take a while to generate. " * 20],
+    })
+    streams, calls = [], []
+
+    def fake_completion(**kwargs):
+        calls.append(kwargs)
+        system = kwargs["messages"][0]["content"]
+        if kwargs.get("stream") and '"title": "PatientExplanation"' in system:
+            streams.append(_FakeStream(json.dumps(unsafe.model_dump())))
+            return streams[-1]
+        return _fake_completion(**kwargs)
+
+    fake_client = MagicMock()
+    fake_client.chat.completions.create.side_effect = fake_completion
+
+    with patch("backend.storage.HISTORY_FILE", str(tmp_path / "history.json")), \
+         patch("backend.llm_client.get_client", return_value=fake_client):
+        data = client.post("/analyze", json={"text": "Anemia text", "mode": "patient"}).json()
+
+    assert data["safety_status"] == "rewritten"
+    assert data["patient_analysis"]["summary"] == MOCK_PATIENT.summary
+    stream = streams[0]
+    assert stream.closed and stream.sent < len(stream.deltas)
+
+    # The rewrite is told the draft was truncated and gets the findings to complete it.
+    rewrite = next(c for c in calls if "Unsafe Draft" in c["messages"][1]["content"])
+    assert "Findings:" in rewrite["messages"][1]["content"]
+    assert "cut off" in rewrite["messages"][0]["content"]
+
+def test_admission_prioritises_critical_and_sheds_with_429(monkeypatch):
+    import os, threading, time
+    from backend import admission
+    from backend.admission import AdmissionController, Overloaded, classify
+
+    data_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "synthetic_data")
+    with open(os.path.join(data_dir, "lab_critical.txt")) as f:
+        assert classify(f.read()) == "critical"
+    with open(os.path.join(data_dir, "lab_normal.txt")) as f:
+        assert classify(f.read()) == "normal"
+    assert classify("IMPRESSION: No critical values identified.") == "normal"
+    assert classify("No prior results. Critical value called to ward.") == "critical"
+
+    controller = AdmissionController(max_concurrent=1, queue_size=1, max_wait=5)
+    release = threading.Event()
+    results = {}
+
+    def run(name, priority):
+        try:
+            with controller.admit(priority):
+                results[name] = "ran"
+                if name == "holder":
+                    release.wait()
+        except Overloaded:
+            results[name] = "shed"
+
+    holder = threading.Thread(target=run, args=("holder", "normal"))
+    holder.start()
+    while controller.get_stats()["running"] == 0:
+        time.sleep(0.01)
+    normal = threading.Thread(target=run, args=("normal", "normal"))
+    normal.start()
+    while controller.get_stats()["classes"]["normal"]["queued"] == 0:
+        time.sleep(0.01)
+    # Queue is full: the critical report takes the normal one's place.
+    critical = threading.Thread(target=run, args=("critical", "critical"))
+    critical.start()
+    normal.join(timeout=5)
+    release.set()
+    for t in (holder, critical):
+        t.join(timeout=5)
+    assert results == {"holder": "ran", "normal": "shed", "critical": "ran"}
+    stats = controller.get_stats()["classes"]
+    assert stats["critical"]["admitted"] == 1 and stats["normal"]["shed"] == 1
+
+    # Saturated with no queue room: the endpoint answers 429 with a retry hint.
+    full = AdmissionController(max_concurrent=1, queue_size=0, max_wait=5)
+    full._running = 1
+    monkeypatch.setattr(admission, "_controller", full)
+    response = client.post("/analyze", json={"text": "Routine text", "mode": "patient"})
+    assert response.status_code == 429
+    assert int(response.headers["retry-after"]) >= 1
+    assert client.get("/metrics/admission").json()["classes"]["normal"]["shed"] == 1
+
+def test_compaction_archives_old_reports(tmp_path, monkeypatch):
+    from backend import retention
+    with patch("backend.storage.HISTORY_FILE", str(tmp_path / "history.json")):
+        from backend.storage import save_report, _load_history
+        ids = [
+            save_report({
+                "extraction": {"report_type": "Lab", "labs": [{"name": "Potassium", "value": 4.0 + i / 10, "unit": "mmol/L"}]},
+                "red_flags": [], "original_text": f"report {i}",
+            })
+            for i in range(5)
+        ]
+        cursor = client.get("/history/changes").json()["cursor"]
+
+        # Admin endpoints are off until a token is configured.
+        monkeypatch.delenv("ADMIN_TOKEN", raising=False)
+        assert client.post("/admin/compact", params={"max_entries": 2}).status_code == 403
+        monkeypatch.setenv("ADMIN_TOKEN", "secret")
+        assert client.post("/admin/compact", params={"max_entries": 2}).status_code == 403
+        retention.compact(max_entries=2)
+        status = client.get("/admin/compact", headers={"X-Admin-Token": "secret"}).json()
+        assert status["state"] == "done" and status["archived"] == 3
+
+        assert [e["id"] for e in _load_history()] == ids[3:]
+        assert (tmp_path / "archive" / status["segment"]).exists()
+        # Archived reports are still served by id and searched, also after an index rebuild.
+        assert client.get(f"/history/{ids[0]}").json()["original_text"] == "report 0"
+        from backend.search_index import rebuild_index
+        assert [r["id"] for r in client.get("/search", params={"q": "report"}).json()] == ids[::-1]
+        rebuild_index()
+        assert [r["id"] for r in client.get("/search", params={"q": "report"}).json()] == ids[::-1]
+        # Unknown ids are answered from the id index without opening any segment.
+        with patch("backend.retention.gzip.open", side_effect=AssertionError("segment opened")):
+            assert client.get("/history/not-a-report").status_code == 404
+        # Lab trends still include the archived reports, also after a rebuild.
+        from backend import lab_series
+        lab_series._loaded_from = None
+        trend = client.get("/trends/potassium").json()
+        assert [p["report_id"] for p in trend["points"]] == ids
+
+        # Sequence numbers keep increasing after everything has been archived.
+        import time
+        time.sleep(0.1)
+        retention.compact(max_entries=0, max_age_days=0.000001)  # ~0.09s
+        assert _load_history() == []
+        new_id = save_report({"extraction": {"report_type": "Lab"}, "red_flags": []})
+        assert [c["id"] for c in client.get("/history/changes", params={"since": cursor}).json()["changes"]] == [new_id]
+
+def test_mechanical_violations_are_rewritten_locally(tmp_path):
+    import json
+    from backend.safety_validator import validate_output
+    draft = MOCK_PATIENT.model_copy(update={
+        "summary": "Potassium is dangerously high. There is nothing to worry about.",
+        "questions_to_ask": ["How might this affect my health?", "What does a potassium of 6.2 mean?"],
+    })
+    calls = []
+
+    def fake_completion(**kwargs):
+        calls.append(kwargs)
+        if '"title": "PatientExplanation"' in kwargs["messages"][0]["content"]:
+            payload = json.dumps(draft.model_dump())
+            return _FakeStream(payload) if kwargs.get("stream") else _fake_completion(**kwargs)
+        return _fake_completion(**kwargs)
+
+    fake_client = MagicMock()
+    fake_client.chat.completions.create.side_effect = fake_completion
+    with patch("backend.storage.HISTORY_FILE", str(tmp_path / "history.json")), \
+         patch("backend.llm_client.get_client", return_value=fake_client):
+        data = client.post("/analyze", json={"text": "Potassium text", "mode": "patient"}).json()
+
+    assert data["safety_status"] == "rewritten"
+    assert {v["rule"] for v in data["violations"]} == {"SEVERITY", "PHRASING"}
+    assert not any("Unsafe Draft" in c["messages"][1]["content"] for c in calls)
+    patient = data["patient_analysis"]
+    assert patient["summary"].startswith("Potassium is flagged as high based on the reference range provided.")
+    assert validate_output(json.dumps(patient))["is_safe"]
+
+def test_local_rewrites_replace_whole_sentences_for_severity_adjectives():
+    from backend.safety_validator import REVIEW_SENTENCE, rewrite_locally
+    assert rewrite_locally("A life-threatening arrhythmia may occur.") == (REVIEW_SENTENCE, 1)
+    assert rewrite_locally("This is a dangerous level of potassium. Sodium is 140.")[0] == \
+        f"{REVIEW_SENTENCE} Sodium is 140."
+    # Abbreviations and decimals do not end a sentence.
+    assert rewrite_locally("Dr. Smith says there is nothing to worry about. Potassium is 6.2.")[0] == \
+        f"{REVIEW_SENTENCE} Potassium is 6.2."
+
+def test_stream_continues_only_past_locally_rewritable_english():
+    import pytest
+    from backend.llm_client import _stream_with_safety_check
+    from backend.safety_validator import SafetyViolation
+    filler = " Filler text." * 20
+
+    def stream(text, language):
+        fake_client = MagicMock()
+        fake_client.chat.completions.create.return_value = _FakeStream(text + filler)
+        return _stream_with_safety_check(fake_client, "model", {}, language)
+
+    assert stream("There is nothing to worry about.", "English").endswith(filler)
+    with pytest.raises(SafetyViolation):
+        stream("There is nothing to worry about.", "Spanish")
+    # "emergency" has no local rewrite, so it aborts even in English.
+    with pytest.raises(SafetyViolation):
+        stream("This is an emergency.", "English")
+
+def test_profiling_is_opt_in_per_request(tmp_path, monkeypatch):
+    import time
+    from backend.profiling import list_profiles
+
+    def slow_completion(**kwargs):
+        time.sleep(0.05)
+        return _fake_completion(**kwargs)
+
+    fake_client = MagicMock()
+    fake_client.chat.completions.create.side_effect = slow_completion
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+    admin = {"X-Admin-Token": "secret"}
+    with patch("backend.storage.HISTORY_FILE", str(tmp_path / "history.json")), \
+         patch("backend.llm_client.get_client", return_value=fake_client):
+        before = len(list_profiles())
+        client.post("/analyze", json={"text": "Unprofiled", "mode": "patient"})
+        assert len(list_profiles()) == before
+
+        # The header alone (no or wrong admin token) does not start a profile.
+        client.post("/analyze", json={"text": "Unprofiled", "mode": "patient"}, headers={"X-Profile": "1"})
+        monkeypatch.delenv("ADMIN_TOKEN")
+        client.post("/analyze", json={"text": "Unprofiled", "mode": "patient"}, headers={"X-Profile": "1"})
+        assert len(list_profiles()) == before
+        monkeypatch.setenv("ADMIN_TOKEN", "secret")
+
+        response = client.post("/analyze", json={"text": "Profiled", "mode": "patient"}, headers={"X-Profile": "1", **admin})
+        assert response.status_code == 200
+
+    latest = client.get("/admin/profiles", headers=admin).json()[0]
+    assert latest["name"] == "_run_analysis" and latest["trigger"] == "header"
+    assert latest["samples"] > 0
+    folded = client.get(f"/admin/profiles/{latest['id']}", headers=admin).text
+    lines = folded.splitlines()
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+    assert any(line.startswith("request;") and "analyze_report (logic.py" in line for line in lines)
+    # Fan-out threads working for the request are sampled too.
+    assert any(line.startswith("worker;") and "generate_safe_content (logic.py" in line for line in lines)
+
+def test_upload_and_analyze_streams_events(tmp_path, monkeypatch):
+    import json
+    from backend import llm_client
+    monkeypatch.setattr(llm_client, "EXTRACTION_CHUNK_CHARS", 300)
+    # pypdf is mocked for this module; serve three pages of text through the mock.
+    pages = [
+        MagicMock(**{"extract_text.return_value": "\n".join(
+            ["LABORATORY REPORT"] + [f"CHEMISTRY PANEL {p}-{i}: Sodium 140 mmol/L (Ref: 135-145)" for i in range(12)]
+        )})
+        for p in range(3)
+    ]
+    monkeypatch.setattr(sys.modules["pypdf"], "PdfReader", MagicMock(return_value=MagicMock(pages=pages)))
+    fake_client = MagicMock()
+    fake_client.chat.completions.create.side_effect = _fake_completion
+
+    with patch("backend.storage.HISTORY_FILE", str(tmp_path / "history.json")), \
+         patch("backend.llm_client.get_client", return_value=fake_client):
+        response = client.post(
+            "/analyze_file",
+            files={"file": ("report.pdf", b"%PDF-1.4", "application/pdf")},
+            data={"mode": "patient"},
+        )
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        events = [json.loads(line) for line in response.text.splitlines()]
+
+        kinds = [e["event"] for e in events]
+        assert kinds == ["page", "page", "page", "text", "extraction", "result"]
+        # Extraction of the first chunks started before the last page was parsed.
+        assert events[1]["chunks_started"] >= 1
+        result = events[-1]["data"]
+        assert "CHEMISTRY PANEL 2-11" in result["original_text"]
+        assert result["original_text"].count("\f") == 2
+        extracted = client.post("/extract_text", files={"file": ("report.pdf", b"%PDF-1.4", "application/pdf")}).json()
+        assert extracted["text"] == result["original_text"]
+        assert any(d["stage"] == "extraction" for d in result["routing"])
+        assert client.get(f"/history/{result['id']}").status_code == 200
+
+    assert client.post("/analyze_file", files={"file": ("a.txt", b"x", "text/plain")}).status_code == 400
+
+def test_upload_of_scan_without_text_skips_extraction(tmp_path):
+    import json
+    fake_client = MagicMock()
+    fake_client.chat.completions.create.side_effect = _fake_completion
+
+    with patch("backend.storage.HISTORY_FILE", str(tmp_path / "history.json")), \
+         patch("backend.llm_client.get_client", return_value=fake_client), \
+         patch("backend.llm_client.extract_text_from_image", return_value="[[NO_REPORT_TEXT_FOUND]]"), \
+         patch("backend.llm_client._extract_chunk") as extract_chunk:
+        response = client.post(
+            "/analyze_file",
+            files={"file": ("scan.png", b"\x89PNG", "image/png")},
+            data={"mode": "patient"},
+        )
+        assert response.status_code == 200
+        events = [json.loads(line) for line in response.text.splitlines()]
+
+    extraction = next(e for e in events if e["event"] == "extraction")
+    assert extraction["extraction"]["report_type"] == "Imaging Scan (No Text)"
+    assert extraction["extraction"]["findings"] == []
+    extract_chunk.assert_not_called()
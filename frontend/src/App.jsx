@@ -29,24 +29,24 @@ function App() {
     const [loading, setLoading] = useState(false);
     const [error, setError] = useState(null);
 
+    const languageName = () => {
+        if (i18n.language.startsWith('es')) return 'Spanish';
+        if (i18n.language.startsWith('fr')) return 'French';
+        if (i18n.language.startsWith('zh')) return 'Mandarin';
+        if (i18n.language.startsWith('hi')) return 'Hindi';
+        return 'English';
+    };
+
     const handleAnalyze = async () => {
         setLoading(true);
         setError(null);
         setAnalysis(null);
 
         try {
-            let langName = 'English';
-            if (i18n.language.startsWith('es')) langName = 'Spanish';
-            else if (i18n.language.startsWith('fr')) langName = 'French';
-            else if (i18n.language.startsWith('zh')) langName = 'Mandarin';
-            else if (i18n.language.startsWith('hi')) langName = 'Hindi';
-
-            else if (i18n.language.startsWith('hi')) langName = 'Hindi';
-
             const response = await axios.post(`${API_BASE}/analyze`, {
                 text,
                 mode,
-                language: langName
+                language: languageName()
             });
             setAnalysis(response.data);
             saveToHistory(response.data);
@@ -60,6 +60,52 @@ function App() {
         }
     };
 
+    // Uploads go through /analyze_file: the server reads, extracts and analyses the file in
+    // one call and streams progress as JSON lines, ending with the result.
+    const handleAnalyzeFile = async (file) => {
+        setLoading(true);
+        setError(null);
+        setAnalysis(null);
+
+        const formData = new FormData();
+        formData.append('file', file);
+        formData.append('mode', mode);
+        formData.append('language', languageName());
+
+        try {
+            const response = await fetch(`${API_BASE}/analyze_file`, { method: 'POST', body: formData });
+            if (!response.ok) {
+                const body = await response.json().catch(() => ({}));
+                throw new Error(body.detail || t('upload_error_generic'));
+            }
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            while (true) {
+                const { done, value } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+                const lines = buffer.split('\n');
+                buffer = lines.pop();
+                for (const line of lines) {
+                    if (!line.trim()) continue;
+                    const event = JSON.parse(line);
+                    if (event.event === 'error') throw new Error(event.detail);
+                    if (event.event === 'result') {
+                        setText(event.data.original_text);
+                        setAnalysis(event.data);
+                        saveToHistory(event.data);
+                    }
+                }
+            }
+        } catch (err) {
+            console.error(err);
+            setError(err.message || 'Failed to analyze report. Please ensure the backend is running.');
+        } finally {
+            setLoading(false);
+        }
+    };
+
     const handleHistorySelect = (id) => {
         setSelectedReportId(id);
         // We stay in history view, but the component renderer handles list vs detail
@@ -106,6 +152,7 @@ function App() {
                             text={text}
                             setText={setText}
                             onAnalyze={handleAnalyze}
+                            onAnalyzeFile={handleAnalyzeFile}
                             loading={loading}
                         />
 
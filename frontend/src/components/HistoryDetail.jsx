@@ -17,20 +17,17 @@ export default function HistoryDetail({ reportId, onBack }) {
     const API_BASE = import.meta.env.VITE_API_URL || "http://127.0.0.1:8000";
 
     useEffect(() => {
-        const data = getReport(reportId);
-        if (data) {
-            setReport(data);
-        } else {
-            setError("Report not found in local history.");
-        }
-        setLoading(false);
+        getReport(API_BASE, reportId)
+            .then(setReport)
+            .catch(() => setError("Report not found."))
+            .finally(() => setLoading(false));
     }, [reportId]);
 
     const handleDownloadPdf = async () => {
         if (!report) return;
         setDownloading(true);
         try {
-            const response = await axios.post(`${API_BASE}/generate_pdf`, report, {
+            const response = await axios.get(`${API_BASE}/history/${reportId}/pdf`, {
                 responseType: 'blob'
             });
 
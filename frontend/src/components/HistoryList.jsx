@@ -3,7 +3,7 @@ import React, { useEffect, useState } from 'react';
 
 import { Calendar, FileText, AlertTriangle, ArrowRight, Clock } from 'lucide-react';
 import { useTranslation } from 'react-i18next';
-import { getHistory } from '../utils/history';
+import { getHistory, syncHistory } from '../utils/history';
 
 export default function HistoryList({ onSelectReport }) {
     const { t } = useTranslation();
@@ -11,9 +11,20 @@ export default function HistoryList({ onSelectReport }) {
     const [loading, setLoading] = useState(true);
     const [error, setError] = useState(null);
 
+    const API_BASE = import.meta.env.VITE_API_URL || "http://127.0.0.1:8000";
+
     useEffect(() => {
-        setHistory(getHistory());
-        setLoading(false);
+        // Show the cached list right away, then fetch only what changed since last time.
+        const cached = getHistory();
+        setHistory(cached);
+        if (cached.length > 0) setLoading(false);
+        syncHistory(API_BASE)
+            .then(setHistory)
+            .catch((err) => {
+                console.error("History sync failed:", err);
+                if (cached.length === 0) setError("Failed to load history. Please ensure the backend is running.");
+            })
+            .finally(() => setLoading(false));
     }, []);
 
     if (loading) {
@@ -1,12 +1,10 @@
 import React, { useState } from 'react';
 import { useTranslation } from 'react-i18next';
 import { FileText, Search, Upload, Loader2 } from 'lucide-react';
-import axios from 'axios';
 
-export default function InputSection({ text, setText, onAnalyze, loading }) {
+export default function InputSection({ text, setText, onAnalyze, onAnalyzeFile, loading }) {
     const { t } = useTranslation();
     const [uploading, setUploading] = useState(false);
-    const API_BASE = import.meta.env.VITE_API_URL || "http://127.0.0.1:8000";
 
     const handleFileUpload = async (event) => {
         const file = event.target.files[0];
@@ -18,19 +16,8 @@ export default function InputSection({ text, setText, onAnalyze, loading }) {
         }
 
         setUploading(true);
-        const formData = new FormData();
-        formData.append('file', file);
-
         try {
-            const response = await axios.post(`${API_BASE}/extract_text`, formData, {
-                headers: {
-                    'Content-Type': 'multipart/form-data',
-                },
-            });
-            setText(response.data.text);
-        } catch (err) {
-            console.error(err);
-            alert(t('upload_error_generic'));
+            await onAnalyzeFile(file);
         } finally {
             setUploading(false);
             // Reset input
@@ -1,48 +1,62 @@
-const HISTORY_KEY = 'dual_mode_ai_history';
+import axios from 'axios';
 
-export const saveToHistory = (analysis) => {
+const HISTORY_KEY = 'dual_mode_ai_history_index';
+
+// Only list metadata is kept locally; full reports are fetched from the backend by id.
+const toSummary = (analysis) => ({
+    id: analysis.id,
+    timestamp: analysis.timestamp || new Date().toISOString(),
+    report_type: analysis.report_type || analysis.extraction?.report_type || 'Unknown',
+    red_flags: analysis.red_flags || []
+});
+
+const readIndex = () => {
     try {
-        const historyJson = localStorage.getItem(HISTORY_KEY);
-        let history = historyJson ? JSON.parse(historyJson) : [];
-
-        // Check if report with same ID (if exists) is already saved
-        if (analysis.id) {
-            const existingIndex = history.findIndex(h => h.id === analysis.id);
-            if (existingIndex >= 0) {
-                // Update existing? Or just return? Let's return to avoid duplicates
-                return;
-            }
-        }
-
-        // Add new analysis to top
-        history.unshift(analysis);
-
-        // Limit to 50 items to prevent storage issues
-        if (history.length > 50) {
-            history = history.slice(0, 50);
-        }
-
-        localStorage.setItem(HISTORY_KEY, JSON.stringify(history));
+        const indexJson = localStorage.getItem(HISTORY_KEY);
+        return indexJson ? JSON.parse(indexJson) : { cursor: null, items: [] };
     } catch (e) {
-        console.error("Failed to save to history:", e);
+        console.error("Failed to read history:", e);
+        return { cursor: null, items: [] };
     }
 };
 
-export const getHistory = () => {
+const writeIndex = (index) => {
     try {
-        const historyJson = localStorage.getItem(HISTORY_KEY);
-        return historyJson ? JSON.parse(historyJson) : [];
+        localStorage.setItem(HISTORY_KEY, JSON.stringify(index));
     } catch (e) {
-        console.error("Failed to read history:", e);
-        return [];
+        console.error("Failed to save history:", e);
     }
 };
 
-export const getReport = (id) => {
-    try {
-        const history = getHistory();
-        return history.find(h => h.id === id) || null;
-    } catch (e) {
-        return null;
+export const saveToHistory = (analysis) => {
+    if (!analysis.id) return;
+    const index = readIndex();
+    if (index.items.some(h => h.id === analysis.id)) return;
+    index.items.unshift(toSummary(analysis));
+    writeIndex(index);
+};
+
+export const getHistory = () => readIndex().items;
+
+// Pulls metadata for reports saved since the last sync and merges it into the local index.
+export const syncHistory = async (apiBase) => {
+    let index = readIndex();
+    let hasMore = true;
+    while (hasMore) {
+        const params = index.cursor ? { since: index.cursor } : {};
+        const { data } = await axios.get(`${apiBase}/history/changes`, { params });
+        const items = data.reset ? [] : index.items;
+        const known = new Set(items.map(h => h.id));
+        const added = data.changes.filter(h => !known.has(h.id)).map(toSummary);
+        index = { cursor: data.cursor, items: [...added.reverse(), ...items] };
+        hasMore = data.has_more;
     }
+    index.items.sort((a, b) => b.timestamp.localeCompare(a.timestamp));
+    writeIndex(index);
+    return index.items;
+};
+
+export const getReport = async (apiBase, id) => {
+    const { data } = await axios.get(`${apiBase}/history/${id}`);
+    return data;
 };